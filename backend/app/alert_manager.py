@@ -81,6 +81,24 @@ ALERT_CONFIGS = {
     }
 }
 
+# Confidence bands stored with each alert (lower bound, label), highest first.
+# Keep in sync with the confidence_band backfill in database.init_database.
+CONFIDENCE_BANDS = [
+    (0.8, "High (80%+)"),
+    (0.6, "Medium (60-80%)"),
+    (0.4, "Low (40-60%)"),
+]
+LOWEST_CONFIDENCE_BAND = "Very Low (<40%)"
+
+
+def get_confidence_band(confidence_score: Optional[float]) -> str:
+    """Map a confidence score to its reporting band"""
+    if confidence_score is not None:
+        for lower_bound, label in CONFIDENCE_BANDS:
+            if confidence_score >= lower_bound:
+                return label
+    return LOWEST_CONFIDENCE_BAND
+
 
 class AlertManager:
     """Manages alert generation, storage, and retrieval"""
@@ -213,9 +231,9 @@ class AlertManager:
                 INSERT INTO alerts 
                 (alert_id, timestamp, severity, alert_type, title, description,
                  affected_region, service_category, risk_score, confidence_score,
-                 action_tier, baseline_deviation, reason_codes, suggested_actions, 
-                 status, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 confidence_band, action_tier, baseline_deviation, reason_codes,
+                 suggested_actions, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 alert["alert_id"],
                 alert["timestamp"],
@@ -227,6 +245,7 @@ class AlertManager:
                 alert["service_category"],
                 alert["risk_score"],
                 alert["confidence_score"],
+                get_confidence_band(alert["confidence_score"]),
                 alert["action_tier"],
                 alert["baseline_deviation"],
                 alert["reason_codes"],
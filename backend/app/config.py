@@ -24,6 +24,11 @@ class Settings(BaseSettings):
     RISK_MEDIUM_THRESHOLD: int = 60
     RISK_HIGH_THRESHOLD: int = 80
     
+    # Risk Engine Fast Path (triage before ML and baseline checks)
+    FAST_PATH_BENIGN_MAX_EVENTS: int = 5  # Fewer events, all successful -> LOW
+    FAST_PATH_CRITICAL_MIN_EVENTS: int = 500
+    FAST_PATH_CRITICAL_FAILURE_RATE: float = 0.9
+    
     # Alert Settings
     ALERT_RETENTION_DAYS: int = 90
     
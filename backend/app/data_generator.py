@@ -5,10 +5,12 @@ Generates realistic Aadhaar authentication metadata without real identifiers
 import random
 import uuid
 import hashlib
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Optional
 import numpy as np
-from app.database import get_connection, execute_write
+import pandas as pd
+from app.database import get_connection, execute_write, mark_events_changed
 import json
 
 # Indian States and Districts (Sample)
@@ -27,6 +29,9 @@ STATES = {
     "KL": {"name": "Kerala", "districts": ["TVM", "KCH", "KZD", "EKM", "TSR"]},
 }
 
+# State codes in STATES order, built once for random picks
+STATE_CODES = tuple(STATES.keys())
+
 SERVICE_PROVIDERS = {
     "BANKING": ["SBI", "HDFC", "ICICI", "AXIS", "PNB", "BOB", "KOTAK", "YES", "IDFC", "RBL"],
     "TELECOM": ["JIO", "AIRTEL", "VI", "BSNL", "MTNL"],
@@ -97,15 +102,15 @@ class SyntheticDataGenerator:
             base_failure_rate *= 1.2
         return random.random() < min(base_failure_rate, 0.3)
     
-    def generate_normal_event(self, timestamp: Optional[datetime] = None) -> Dict:
-        """Generate a single normal authentication event"""
+    def generate_normal_event(self, timestamp: Optional[datetime] = None, **overrides) -> Dict:
+        """Generate a single normal authentication event, with any field overrides applied"""
         if timestamp is None:
             timestamp = datetime.now() - timedelta(hours=random.randint(0, 168))
         
         hour = timestamp.hour
         day_of_week = timestamp.weekday()
         
-        state = random.choice(list(STATES.keys()))
+        state = random.choice(STATE_CODES)
         district = random.choice(STATES[state]["districts"])
         service_category = self._get_weighted_service_category(hour, day_of_week)
         service_provider = random.choice(SERVICE_PROVIDERS[service_category])
@@ -121,7 +126,7 @@ class SyntheticDataGenerator:
         status = "FAILURE" if self._should_fail(retry_count, is_fallback) else "SUCCESS"
         failure_reason = random.choice(FAILURE_REASONS) if status == "FAILURE" else None
         
-        return {
+        event = {
             "event_id": self._generate_event_id(),
             "timestamp": timestamp,
             "auth_type": auth_type,
@@ -138,6 +143,9 @@ class SyntheticDataGenerator:
             "day_of_week": int(day_of_week),
             "session_duration_ms": int(np.random.exponential(2000) + 500),
         }
+        if overrides:
+            event.update(overrides)
+        return event
     
     def generate_anomalous_event(self, anomaly_type: str, timestamp: Optional[datetime] = None) -> Dict:
         """Generate an anomalous event based on type"""
@@ -205,44 +213,114 @@ class SyntheticDataGenerator:
         
         return sorted(events, key=lambda x: x["timestamp"])
     
-    def save_to_database(self, events: List[Dict]) -> int:
-        """Save events to database"""
-        conn = get_connection()
-        saved_count = 0
+    def save_to_database(self, events: Iterable[Dict]) -> int:
+        """
+        Save events to database, SAVE_CHUNK_SIZE rows per transaction
         
-        for event in events:
-            try:
-                conn.execute("""
-                    INSERT INTO authentication_events 
-                    (event_id, timestamp, auth_type, service_category, service_provider_id,
-                     device_fingerprint_hash, state_code, district_code, retry_count,
-                     is_fallback, status, failure_reason, hour_of_day, day_of_week,
-                     session_duration_ms, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    event["event_id"],
-                    event["timestamp"],
-                    event["auth_type"],
-                    event["service_category"],
-                    event["service_provider_id"],
-                    event["device_fingerprint_hash"],
-                    event["state_code"],
-                    event["district_code"],
-                    event["retry_count"],
-                    event["is_fallback"],
-                    event["status"],
-                    event["failure_reason"],
-                    event["hour_of_day"],
-                    event["day_of_week"],
-                    event["session_duration_ms"],
-                    datetime.now()
-                ))
-                saved_count += 1
-            except Exception as e:
-                print(f"Error saving event: {e}")
+        A chunk the database rejects (e.g. a duplicate event_id) is rolled back
+        and retried row by row, so only the bad rows are skipped.
+        """
+        events = iter(events)
+        created_at = datetime.now()
+        saved = 0
+        
+        conn = get_connection()
+        try:
+            while True:
+                rows = [
+                    tuple(event[col] for col in EVENT_COLUMNS) + (created_at,)
+                    for event in islice(events, SAVE_CHUNK_SIZE)
+                ]
+                if not rows:
+                    break
+                try:
+                    conn.execute("BEGIN TRANSACTION")
+                    conn.executemany(INSERT_EVENT_SQL, rows)
+                    conn.commit()
+                    saved += len(rows)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Error saving events, retrying chunk row by row: {e}")
+                    saved += _insert_rows_individually(conn, rows)
+        finally:
+            conn.close()
         
+        if saved:
+            mark_events_changed()
+        return saved
+
+
+# Columns written for each authentication event (order matches the INSERT)
+EVENT_COLUMNS = [
+    "event_id", "timestamp", "auth_type", "service_category", "service_provider_id",
+    "device_fingerprint_hash", "state_code", "district_code", "retry_count",
+    "is_fallback", "status", "failure_reason", "hour_of_day", "day_of_week",
+    "session_duration_ms",
+]
+
+# Parameterized insert of one event row, EVENT_COLUMNS followed by created_at
+INSERT_EVENT_SQL = f"""
+    INSERT INTO authentication_events ({", ".join(EVENT_COLUMNS)}, created_at)
+    VALUES ({", ".join("?" * (len(EVENT_COLUMNS) + 1))})
+"""
+
+# Rows per executemany when streaming events into the database
+SAVE_CHUNK_SIZE = 64
+
+
+def _insert_rows_individually(conn, rows: List[tuple]) -> int:
+    """Insert event rows one at a time, skipping any the database rejects"""
+    saved = 0
+    for row in rows:
+        try:
+            conn.execute(INSERT_EVENT_SQL, row)
+            saved += 1
+        except Exception as e:
+            print(f"Error saving event {row[0]}: {e}")
+    return saved
+
+
+def save_events_to_db(events: List[Dict]) -> int:
+    """
+    Bulk-insert events in a single statement
+    
+    The events are laid out as one DataFrame and registered with DuckDB, so the
+    whole batch is copied by a single INSERT ... SELECT instead of per-row calls.
+    If any row is rejected (e.g. a duplicate event_id) the batch is retried row
+    by row, so only the bad rows are skipped. Extra keys on the event dicts are
+    ignored.
+    """
+    if not events:
+        return 0
+    
+    created_at = datetime.now()
+    events_df = pd.DataFrame(events, columns=EVENT_COLUMNS)
+    events_df["created_at"] = created_at
+    columns = ", ".join(EVENT_COLUMNS + ["created_at"])
+    
+    conn = get_connection()
+    try:
+        conn.register("incoming_events", events_df)
+        try:
+            conn.execute(f"""
+                INSERT INTO authentication_events ({columns})
+                SELECT {columns} FROM incoming_events
+            """)
+            saved = len(events_df)
+        except Exception as e:
+            print(f"Bulk insert failed, saving events individually: {e}")
+            rows = [
+                tuple(event.get(col) for col in EVENT_COLUMNS) + (created_at,)
+                for event in events
+            ]
+            saved = _insert_rows_individually(conn, rows)
+        conn.unregister("incoming_events")
+    finally:
         conn.close()
-        return saved_count
+    
+    if saved:
+        mark_events_changed()
+    return saved
 
 
 def generate_initial_dataset(days: int = 30, events_per_day: int = 1000):
@@ -1,18 +1,72 @@
 """
 Database Models and Connection for AMEWS
 """
+import asyncio
+import threading
 import duckdb
 import pandas as pd
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any
 import uuid
 from datetime import datetime, timedelta
 from app.config import settings
 
+# One database handle per process; requests work on cheap cursors of it
+_root_connection: Optional[duckdb.DuckDBPyConnection] = None
+_root_lock = threading.Lock()
+
+# Reusable cursors for async endpoints, filled by init_connection_pool()
+_connection_pool: Optional[asyncio.Queue] = None
+
+# Bumped whenever authentication_events is written, so cached reads of the
+# table can tell that their results are stale. The counter is per process:
+# AMEWS runs as a single worker, and writes made by another process are only
+# picked up by those caches when their minute-keyed entries roll over
+_events_version = 0
+
+def mark_events_changed():
+    """Record a write to authentication_events"""
+    global _events_version
+    _events_version += 1
+
+def events_version() -> int:
+    """Current write generation of authentication_events"""
+    return _events_version
+
+def _get_root_connection() -> duckdb.DuckDBPyConnection:
+    """Open the shared DuckDB database on first use"""
+    global _root_connection
+    if _root_connection is None:
+        with _root_lock:
+            if _root_connection is None:
+                # Extract file path from database URL (remove duckdb:/// prefix)
+                db_path = settings.DATABASE_URL.replace("duckdb:///", "")
+                _root_connection = duckdb.connect(db_path)
+    return _root_connection
+
 def get_connection():
-    """Get a new DuckDB connection for each request"""
-    # Extract file path from database URL (remove duckdb:/// prefix)
-    db_path = settings.DATABASE_URL.replace("duckdb:///", "")
-    return duckdb.connect(db_path)
+    """Get a new cursor on the shared DuckDB database for each request"""
+    return _get_root_connection().cursor()
+
+def init_connection_pool(size: int = 8):
+    """Prefill the pool of reusable cursors used by acquire_conn()"""
+    global _connection_pool
+    pool = asyncio.Queue(maxsize=size)
+    for _ in range(size):
+        pool.put_nowait(get_connection())
+    _connection_pool = pool
+
+@asynccontextmanager
+async def acquire_conn():
+    """Borrow a pooled cursor for the duration of an async request"""
+    if _connection_pool is None:
+        init_connection_pool()
+    pool = _connection_pool
+    conn = await pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put_nowait(conn)
 
 def execute_query_df(query: str, params=None) -> pd.DataFrame:
     """Execute a SQL query and return results as DataFrame"""
@@ -80,6 +134,7 @@ def init_database():
             severity VARCHAR,
             affected_region VARCHAR,
             confidence_score DOUBLE,
+            confidence_band VARCHAR,
             description TEXT,
             details TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -89,6 +144,22 @@ def init_database():
         )
     """)
     
+    # Confidence band is written at insert time so statistics group on a
+    # plain column; backfill alerts created before the column existed
+    conn.execute("ALTER TABLE alerts ADD COLUMN IF NOT EXISTS confidence_band VARCHAR")
+    conn.execute("""
+        UPDATE alerts SET confidence_band = CASE
+            WHEN confidence_score >= 0.8 THEN 'High (80%+)'
+            WHEN confidence_score >= 0.6 THEN 'Medium (60-80%)'
+            WHEN confidence_score >= 0.4 THEN 'Low (40-60%)'
+            ELSE 'Very Low (<40%)'
+        END
+        WHERE confidence_band IS NULL
+    """)
+    
+    # Alert statistics all filter on a rolling created_at window
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_created_at ON alerts(created_at)")
+    
     # Create region_baselines table
     conn.execute("""
         CREATE TABLE IF NOT EXISTS region_baselines (
@@ -14,7 +14,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
 from app.config import settings
-from app.database import init_database, get_connection, execute_query_df
+from app.database import init_database, get_connection, execute_query_df, init_connection_pool, acquire_conn
 from app.models import (
     AuthenticationEventCreate, BatchIngestRequest, BatchIngestResponse,
     RiskScoreRequest, RiskScoreResponse, Alert, AlertUpdate, AlertsResponse,
@@ -27,10 +27,10 @@ from app.auth import (
     get_current_user_required, log_audit
 )
 from app.risk_engine import risk_engine
-from app.alert_manager import alert_manager, run_periodic_analysis
+from app.alert_manager import alert_manager, run_periodic_analysis, get_confidence_band
 from app.baseline_engine import baseline_engine
 from app.simulation import simulation_engine
-from app.data_generator import SyntheticDataGenerator, STATES, generate_initial_dataset
+from app.data_generator import STATES, generate_initial_dataset, save_events_to_db
 from app.otp_auth import send_otp, verify_otp, resend_otp, get_demo_users, get_gateway_status
 from app.dataset_loader import get_dataset_loader
 
@@ -61,6 +61,7 @@ async def lifespan(app: FastAPI):
     # Startup
     print("Initializing AMEWS Backend...")
     init_database()
+    init_connection_pool()
     
     # Load actual datasets
     print("Loading UIDAI datasets...")
@@ -80,9 +81,7 @@ async def lifespan(app: FastAPI):
         print("Generating initial dataset from actual data patterns...")
         # Use dataset-based generation
         events = loader.generate_auth_events_from_data(count=5000)
-        from app.data_generator import save_events_to_db
-        for event in events:
-            save_events_to_db([event])
+        save_events_to_db(events)
         print(f"Generated {len(events)} events from dataset patterns.")
     
     # Initialize baseline learning system
@@ -161,9 +160,11 @@ def generate_sample_alerts():
         
         conn.execute("""
             INSERT INTO alerts (alert_id, alert_type, severity, affected_region,
-                              confidence_score, description, created_at, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 'OPEN')
-        """, (alert_id, alert_type, severity, state, confidence, description, timestamp))
+                              confidence_score, confidence_band, description,
+                              created_at, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'OPEN')
+        """, (alert_id, alert_type, severity, state, confidence,
+              get_confidence_band(confidence), description, timestamp))
     
     print(f"Generated 12 sample alerts")
 
@@ -185,14 +186,12 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    conn = get_connection()
-    try:
-        conn.execute("SELECT 1")
-        db_status = "healthy"
-    except:
-        db_status = "unhealthy"
-    finally:
-        conn.close()
+    async with acquire_conn() as conn:
+        try:
+            conn.execute("SELECT 1")
+            db_status = "healthy"
+        except:
+            db_status = "unhealthy"
     
     return {
         "status": "healthy",
@@ -337,8 +336,6 @@ async def ingest_single_event(
     user: dict = Depends(get_current_user)
 ):
     """Ingest a single authentication event"""
-    generator = SyntheticDataGenerator()
-    
     event_dict = {
         "event_id": f"evt_{uuid.uuid4().hex[:16]}",
         "timestamp": event.timestamp,
@@ -357,7 +354,7 @@ async def ingest_single_event(
         "session_duration_ms": event.session_duration_ms,
     }
     
-    saved = generator.save_to_database([event_dict])
+    saved = save_events_to_db([event_dict])
     
     # Trigger background risk analysis
     background_tasks.add_task(
@@ -375,7 +372,6 @@ async def ingest_batch(
     user: dict = Depends(get_current_user)
 ):
     """Ingest a batch of authentication events"""
-    generator = SyntheticDataGenerator()
     events = []
     errors = []
     
@@ -402,7 +398,7 @@ async def ingest_batch(
         except Exception as e:
             errors.append(f"Event {i}: {str(e)}")
     
-    saved = generator.save_to_database(events)
+    saved = save_events_to_db(events)
     
     # Trigger background analysis
     background_tasks.add_task(run_periodic_analysis)
@@ -455,40 +451,40 @@ async def analyze_risk(
 @app.get("/api/risk/overview")
 async def get_risk_overview(user: dict = Depends(get_current_user)):
     """Get overall risk overview for dashboard"""
-    conn = get_connection()
-    # High risk devices
-    high_risk_devices = conn.execute("""
-        SELECT device_fingerprint_hash, COUNT(*) as event_count,
-               AVG(retry_count) as avg_retries
-        FROM authentication_events
-        WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-        GROUP BY device_fingerprint_hash
-        HAVING COUNT(*) > 20 OR AVG(retry_count) > 3
-        ORDER BY event_count DESC
-        LIMIT 10
-    """).fetchall()
-    
-    # High risk regions
-    high_risk_regions = conn.execute("""
-        SELECT state_code, COUNT(*) as event_count,
-               SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures
-        FROM authentication_events
-        WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-        GROUP BY state_code
-        ORDER BY failures DESC
-        LIMIT 10
-    """).fetchall()
-    
-    return {
-        "high_risk_devices": [
-            {"device": d[0][:16] + "...", "events": d[1], "avg_retries": round(d[2], 2)}
-            for d in high_risk_devices
-        ],
-        "high_risk_regions": [
-            {"region": r[0], "events": r[1], "failures": r[2]}
-            for r in high_risk_regions
-        ]
-    }
+    async with acquire_conn() as conn:
+        # High risk devices
+        high_risk_devices = conn.execute("""
+            SELECT device_fingerprint_hash, COUNT(*) as event_count,
+                   AVG(retry_count) as avg_retries
+            FROM authentication_events
+            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+            GROUP BY device_fingerprint_hash
+            HAVING COUNT(*) > 20 OR AVG(retry_count) > 3
+            ORDER BY event_count DESC
+            LIMIT 10
+        """).fetchall()
+        
+        # High risk regions
+        high_risk_regions = conn.execute("""
+            SELECT state_code, COUNT(*) as event_count,
+                   SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures
+            FROM authentication_events
+            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+            GROUP BY state_code
+            ORDER BY failures DESC
+            LIMIT 10
+        """).fetchall()
+        
+        return {
+            "high_risk_devices": [
+                {"device": d[0][:16] + "...", "events": d[1], "avg_retries": round(d[2], 2)}
+                for d in high_risk_devices
+            ],
+            "high_risk_regions": [
+                {"region": r[0], "events": r[1], "failures": r[2]}
+                for r in high_risk_regions
+            ]
+        }
 # ============== Alert Endpoints ==============
 
 @app.get("/api/alerts")
@@ -503,23 +499,23 @@ async def get_alerts(
     alerts = alert_manager.get_alerts(status, severity, limit, offset)
     
     # Get total count
-    conn = get_connection()
-    conditions = ["1=1"]
-    if status:
-        conditions.append(f"status = '{status}'")
-    if severity:
-        conditions.append(f"severity = '{severity}'")
-    
-    total = conn.execute(
-        f"SELECT COUNT(*) FROM alerts WHERE {' AND '.join(conditions)}"
-    ).fetchone()[0]
-    
-    return {
-        "alerts": alerts,
-        "total_count": total,
-        "page": offset // limit + 1,
-        "page_size": limit
-    }
+    async with acquire_conn() as conn:
+        conditions = ["1=1"]
+        if status:
+            conditions.append(f"status = '{status}'")
+        if severity:
+            conditions.append(f"severity = '{severity}'")
+        
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM alerts WHERE {' AND '.join(conditions)}"
+        ).fetchone()[0]
+        
+        return {
+            "alerts": alerts,
+            "total_count": total,
+            "page": offset // limit + 1,
+            "page_size": limit
+        }
 
 
 @app.get("/api/alerts/{alert_id}")
@@ -569,119 +565,119 @@ async def get_alert_statistics(user: dict = Depends(get_current_user)):
 @app.get("/api/dashboard/metrics", response_model=DashboardMetrics)
 async def get_dashboard_metrics(user: dict = Depends(get_current_user)):
     """Get dashboard metrics"""
-    conn = get_connection()
-    try:
-        # Events today
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        events_today = conn.execute(
-            "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ?",
-            (today_start,)
-        ).fetchone()[0]
-        
-        # Events this week
-        week_start = today_start - timedelta(days=7)
-        events_week = conn.execute(
-            "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ?",
-            (week_start,)
-        ).fetchone()[0]
-        
-        # Events previous week (for trend)
-        prev_week_start = week_start - timedelta(days=7)
-        events_prev_week = conn.execute(
-            "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ? AND timestamp < ?",
-            (prev_week_start, week_start)
-        ).fetchone()[0]
-        
-        # Calculate trend
-        if events_prev_week > 0:
-            trend = ((events_week - events_prev_week) / events_prev_week) * 100
-        else:
-            trend = 0
-        
-        # Active alerts
-        active_alerts = conn.execute(
-            "SELECT COUNT(*) FROM alerts WHERE status = 'ACTIVE'"
-        ).fetchone()[0]
-        
-        # Critical alerts
-        critical_alerts = conn.execute(
-            "SELECT COUNT(*) FROM alerts WHERE status = 'ACTIVE' AND severity = 'CRITICAL'"
-        ).fetchone()[0]
-        
-        # High risk events (events with retry > 3 or failure)
-        high_risk_events = conn.execute(
-            """SELECT COUNT(*) FROM authentication_events 
-               WHERE timestamp >= ? AND (retry_count >= 3 OR status = 'FAILURE')""",
-            (today_start,)
-        ).fetchone()[0]
-        
-        # Average risk score (simplified calculation)
-        avg_risk = conn.execute(
-            "SELECT AVG(risk_score) FROM alerts WHERE timestamp >= ?",
-            (week_start,)
-        ).fetchone()[0] or 0
-        
-        # Events by hour (last 24 hours)
-        events_by_hour = conn.execute("""
-            SELECT hour_of_day, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day
-        """).fetchall()
-        
-        # Events by service
-        events_by_service = conn.execute("""
-            SELECT service_category, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-            GROUP BY service_category
-            ORDER BY count DESC
-        """).fetchall()
-        
-        # Risk by region
-        risk_by_region = conn.execute("""
-            SELECT state_code, 
-                   COUNT(*) as total,
-                   SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures,
-                   AVG(retry_count) as avg_retries
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-            GROUP BY state_code
-        """).fetchall()
-        
-        # Auth type distribution
-        auth_dist = conn.execute("""
-            SELECT auth_type, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-            GROUP BY auth_type
-        """).fetchall()
-        
-        return DashboardMetrics(
-            total_events_today=events_today,
-            total_events_week=events_week,
-            active_alerts=active_alerts,
-            high_risk_events=high_risk_events,
-            critical_alerts=critical_alerts,
-            avg_risk_score=round(avg_risk, 1),
-            trend_percentage=round(trend, 1),
-            events_by_hour=[{"hour": h[0], "count": h[1]} for h in events_by_hour],
-            events_by_service=[{"service": s[0], "count": s[1]} for s in events_by_service],
-            risk_by_region=[
-                {
-                    "state": r[0], 
-                    "state_name": STATES.get(r[0], {}).get("name", r[0]),
-                    "total": r[1],
-                    "failures": r[2],
-                    "risk_score": min(100, (r[2] / max(r[1], 1)) * 100 + r[3] * 10)
-                }
-                for r in risk_by_region
-            ],
-            auth_type_distribution=[{"type": a[0], "count": a[1]} for a in auth_dist]
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with acquire_conn() as conn:
+        try:
+            # Events today
+            today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            events_today = conn.execute(
+                "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ?",
+                (today_start,)
+            ).fetchone()[0]
+            
+            # Events this week
+            week_start = today_start - timedelta(days=7)
+            events_week = conn.execute(
+                "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ?",
+                (week_start,)
+            ).fetchone()[0]
+            
+            # Events previous week (for trend)
+            prev_week_start = week_start - timedelta(days=7)
+            events_prev_week = conn.execute(
+                "SELECT COUNT(*) FROM authentication_events WHERE timestamp >= ? AND timestamp < ?",
+                (prev_week_start, week_start)
+            ).fetchone()[0]
+            
+            # Calculate trend
+            if events_prev_week > 0:
+                trend = ((events_week - events_prev_week) / events_prev_week) * 100
+            else:
+                trend = 0
+            
+            # Active alerts
+            active_alerts = conn.execute(
+                "SELECT COUNT(*) FROM alerts WHERE status = 'ACTIVE'"
+            ).fetchone()[0]
+            
+            # Critical alerts
+            critical_alerts = conn.execute(
+                "SELECT COUNT(*) FROM alerts WHERE status = 'ACTIVE' AND severity = 'CRITICAL'"
+            ).fetchone()[0]
+            
+            # High risk events (events with retry > 3 or failure)
+            high_risk_events = conn.execute(
+                """SELECT COUNT(*) FROM authentication_events 
+                   WHERE timestamp >= ? AND (retry_count >= 3 OR status = 'FAILURE')""",
+                (today_start,)
+            ).fetchone()[0]
+            
+            # Average risk score (simplified calculation)
+            avg_risk = conn.execute(
+                "SELECT AVG(risk_score) FROM alerts WHERE timestamp >= ?",
+                (week_start,)
+            ).fetchone()[0] or 0
+            
+            # Events by hour (last 24 hours)
+            events_by_hour = conn.execute("""
+                SELECT hour_of_day, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+                GROUP BY hour_of_day
+                ORDER BY hour_of_day
+            """).fetchall()
+            
+            # Events by service
+            events_by_service = conn.execute("""
+                SELECT service_category, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+                GROUP BY service_category
+                ORDER BY count DESC
+            """).fetchall()
+            
+            # Risk by region
+            risk_by_region = conn.execute("""
+                SELECT state_code, 
+                       COUNT(*) as total,
+                       SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures,
+                       AVG(retry_count) as avg_retries
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+                GROUP BY state_code
+            """).fetchall()
+            
+            # Auth type distribution
+            auth_dist = conn.execute("""
+                SELECT auth_type, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+                GROUP BY auth_type
+            """).fetchall()
+            
+            return DashboardMetrics(
+                total_events_today=events_today,
+                total_events_week=events_week,
+                active_alerts=active_alerts,
+                high_risk_events=high_risk_events,
+                critical_alerts=critical_alerts,
+                avg_risk_score=round(avg_risk, 1),
+                trend_percentage=round(trend, 1),
+                events_by_hour=[{"hour": h[0], "count": h[1]} for h in events_by_hour],
+                events_by_service=[{"service": s[0], "count": s[1]} for s in events_by_service],
+                risk_by_region=[
+                    {
+                        "state": r[0], 
+                        "state_name": STATES.get(r[0], {}).get("name", r[0]),
+                        "total": r[1],
+                        "failures": r[2],
+                        "risk_score": min(100, (r[2] / max(r[1], 1)) * 100 + r[3] * 10)
+                    }
+                    for r in risk_by_region
+                ],
+                auth_type_distribution=[{"type": a[0], "count": a[1]} for a in auth_dist]
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/dashboard/trends")
 async def get_trends(
@@ -689,104 +685,104 @@ async def get_trends(
     user: dict = Depends(get_current_user)
 ):
     """Get trend data for charts"""
-    conn = get_connection()
-    try:
-        # Daily event counts
-        daily_events = conn.execute(f"""
-            SELECT DATE(timestamp) as date, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        """).fetchall()
-        
-        # Daily failures
-        daily_failures = conn.execute(f"""
-            SELECT DATE(timestamp) as date, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
-                  AND status = 'FAILURE'
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        """).fetchall()
-        
-        # Daily alerts
-        daily_alerts = conn.execute(f"""
-            SELECT DATE(timestamp) as date, COUNT(*) as count
-            FROM alerts
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
-            GROUP BY DATE(timestamp)
-            ORDER BY date
-        """).fetchall()
-        
-        # Service category trends
-        service_trends = conn.execute(f"""
-            SELECT DATE(timestamp) as date, service_category, COUNT(*) as count
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
-            GROUP BY DATE(timestamp), service_category
-            ORDER BY date, service_category
-        """).fetchall()
-        
-        return {
-            "daily_events": [{"date": str(d[0]), "count": d[1]} for d in daily_events],
-            "daily_failures": [{"date": str(d[0]), "count": d[1]} for d in daily_failures],
-            "daily_alerts": [{"date": str(d[0]), "count": d[1]} for d in daily_alerts],
-            "service_trends": [
-                {"date": str(s[0]), "service": s[1], "count": s[2]} 
-                for s in service_trends
-            ]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with acquire_conn() as conn:
+        try:
+            # Daily event counts
+            daily_events = conn.execute(f"""
+                SELECT DATE(timestamp) as date, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
+                GROUP BY DATE(timestamp)
+                ORDER BY date
+            """).fetchall()
+            
+            # Daily failures
+            daily_failures = conn.execute(f"""
+                SELECT DATE(timestamp) as date, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
+                      AND status = 'FAILURE'
+                GROUP BY DATE(timestamp)
+                ORDER BY date
+            """).fetchall()
+            
+            # Daily alerts
+            daily_alerts = conn.execute(f"""
+                SELECT DATE(timestamp) as date, COUNT(*) as count
+                FROM alerts
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
+                GROUP BY DATE(timestamp)
+                ORDER BY date
+            """).fetchall()
+            
+            # Service category trends
+            service_trends = conn.execute(f"""
+                SELECT DATE(timestamp) as date, service_category, COUNT(*) as count
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL {days} DAY
+                GROUP BY DATE(timestamp), service_category
+                ORDER BY date, service_category
+            """).fetchall()
+            
+            return {
+                "daily_events": [{"date": str(d[0]), "count": d[1]} for d in daily_events],
+                "daily_failures": [{"date": str(d[0]), "count": d[1]} for d in daily_failures],
+                "daily_alerts": [{"date": str(d[0]), "count": d[1]} for d in daily_alerts],
+                "service_trends": [
+                    {"date": str(s[0]), "service": s[1], "count": s[2]} 
+                    for s in service_trends
+                ]
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/dashboard/regions")
 async def get_region_data(user: dict = Depends(get_current_user)):
     """Get region-wise data for heatmap"""
-    conn = get_connection()
-    try:
-        region_data = conn.execute("""
-            SELECT 
-                state_code,
-                COUNT(*) as event_count,
-                SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures,
-                AVG(retry_count) as avg_retries,
-                COUNT(DISTINCT device_fingerprint_hash) as unique_devices
-            FROM authentication_events
-            WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
-            GROUP BY state_code
-        """).fetchall()
-        
-        # Get alert counts per region
-        alert_counts = conn.execute("""
-            SELECT affected_region, COUNT(*) as count
-            FROM alerts
-            WHERE status = 'ACTIVE'
-            GROUP BY affected_region
-        """).fetchall()
-        alert_map = {a[0]: a[1] for a in alert_counts}
-        
-        regions = []
-        for r in region_data:
-            state_info = STATES.get(r[0], {"name": r[0]})
-            failure_rate = r[2] / max(r[1], 1)
-            risk_score = min(100, failure_rate * 100 + r[3] * 15)
+    async with acquire_conn() as conn:
+        try:
+            region_data = conn.execute("""
+                SELECT 
+                    state_code,
+                    COUNT(*) as event_count,
+                    SUM(CASE WHEN status = 'FAILURE' THEN 1 ELSE 0 END) as failures,
+                    AVG(retry_count) as avg_retries,
+                    COUNT(DISTINCT device_fingerprint_hash) as unique_devices
+                FROM authentication_events
+                WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 24 HOUR
+                GROUP BY state_code
+            """).fetchall()
             
-            regions.append({
-                "state_code": r[0],
-                "state_name": state_info.get("name", r[0]),
-                "event_count": r[1],
-                "failures": r[2],
-                "failure_rate": round(failure_rate * 100, 2),
-                "avg_retries": round(r[3], 2),
-                "unique_devices": r[4],
-                "alert_count": alert_map.get(r[0], 0),
-                "risk_score": round(risk_score, 1)
-            })
-        
-        return {"regions": regions}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            # Get alert counts per region
+            alert_counts = conn.execute("""
+                SELECT affected_region, COUNT(*) as count
+                FROM alerts
+                WHERE status = 'ACTIVE'
+                GROUP BY affected_region
+            """).fetchall()
+            alert_map = {a[0]: a[1] for a in alert_counts}
+            
+            regions = []
+            for r in region_data:
+                state_info = STATES.get(r[0], {"name": r[0]})
+                failure_rate = r[2] / max(r[1], 1)
+                risk_score = min(100, failure_rate * 100 + r[3] * 15)
+                
+                regions.append({
+                    "state_code": r[0],
+                    "state_name": state_info.get("name", r[0]),
+                    "event_count": r[1],
+                    "failures": r[2],
+                    "failure_rate": round(failure_rate * 100, 2),
+                    "avg_retries": round(r[3], 2),
+                    "unique_devices": r[4],
+                    "alert_count": alert_map.get(r[0], 0),
+                    "risk_score": round(risk_score, 1)
+                })
+            
+            return {"regions": regions}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 # ============== Baseline Learning Endpoints ==============
 
@@ -877,86 +873,82 @@ async def submit_alert_feedback(
     }
 
 
+# Advanced statistics queries are built once at import; the feedback and
+# baseline aggregates share a single scan (AVG/MAX/COUNT already skip NULLs)
+ADVANCED_STATS_CONFIDENCE_SQL = """
+    SELECT confidence_band, COUNT(*) as count
+    FROM alerts
+    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
+    GROUP BY confidence_band
+    ORDER BY MAX(confidence_score) DESC
+"""
+
+ADVANCED_STATS_ACTION_SQL = """
+    SELECT action_tier, COUNT(*) as count
+    FROM alerts
+    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
+    GROUP BY action_tier
+    ORDER BY count DESC
+"""
+
+ADVANCED_STATS_FEEDBACK_BASELINE_SQL = """
+    SELECT
+        COUNT(*) as total_alerts,
+        SUM(CASE WHEN feedback_type = 'FALSE_POSITIVE' THEN 1 ELSE 0 END) as false_positives,
+        SUM(CASE WHEN feedback_type = 'CONFIRMED_THREAT' THEN 1 ELSE 0 END) as confirmed_threats,
+        SUM(CASE WHEN feedback_type IS NOT NULL THEN 1 ELSE 0 END) as reviewed_alerts,
+        AVG(baseline_deviation) as avg_deviation,
+        MAX(baseline_deviation) as max_deviation,
+        COUNT(CASE WHEN baseline_deviation > 0.3 THEN 1 END) as significant_deviations
+    FROM alerts
+    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
+"""
+
+
 @app.get("/api/alerts/statistics/advanced")
 async def get_advanced_alert_statistics(user: dict = Depends(get_current_user)):
     """Get advanced alert statistics including confidence and action distribution"""
-    conn = get_connection()
-    try:
-        # Confidence distribution
-        confidence_dist = conn.execute("""
-            SELECT 
-                CASE 
-                    WHEN confidence_score >= 0.8 THEN 'High (80%+)'
-                    WHEN confidence_score >= 0.6 THEN 'Medium (60-80%)'
-                    WHEN confidence_score >= 0.4 THEN 'Low (40-60%)'
-                    ELSE 'Very Low (<40%)'
-                END as confidence_band,
-                COUNT(*) as count
-            FROM alerts
-            WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
-            GROUP BY 1
-            ORDER BY confidence_score DESC
-        """).fetchall()
-        
-        # Action tier distribution
-        action_dist = conn.execute("""
-            SELECT action_tier, COUNT(*) as count
-            FROM alerts
-            WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
-            GROUP BY action_tier
-            ORDER BY count DESC
-        """).fetchall()
-        
-        # False positive rate
-        fp_stats = conn.execute("""
-            SELECT 
-                COUNT(*) as total_alerts,
-                SUM(CASE WHEN feedback_type = 'FALSE_POSITIVE' THEN 1 ELSE 0 END) as false_positives,
-                SUM(CASE WHEN feedback_type = 'CONFIRMED_THREAT' THEN 1 ELSE 0 END) as confirmed_threats,
-                SUM(CASE WHEN feedback_type IS NOT NULL THEN 1 ELSE 0 END) as reviewed_alerts
-            FROM alerts
-            WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
-        """).fetchone()
-        
-        # Baseline deviation stats
-        baseline_stats = conn.execute("""
-            SELECT 
-                AVG(baseline_deviation) as avg_deviation,
-                MAX(baseline_deviation) as max_deviation,
-                COUNT(CASE WHEN baseline_deviation > 0.3 THEN 1 END) as significant_deviations
-            FROM alerts
-            WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
-              AND baseline_deviation IS NOT NULL
-        """).fetchone()
-        
-        # Calculate false positive rate
-        fp_rate = 0.0
-        if fp_stats and fp_stats[3] > 0:  # reviewed_alerts > 0
-            fp_rate = fp_stats[1] / fp_stats[3]  # false_positives / reviewed_alerts
-        
-        return {
-            "confidence_distribution": [
-                {"band": c[0], "count": c[1]} for c in confidence_dist
-            ],
-            "action_tier_distribution": [
-                {"tier": a[0] or "Unknown", "count": a[1]} for a in action_dist
-            ],
-            "feedback_statistics": {
-                "total_alerts": fp_stats[0] if fp_stats else 0,
-                "false_positives": fp_stats[1] if fp_stats else 0,
-                "confirmed_threats": fp_stats[2] if fp_stats else 0,
-                "reviewed_alerts": fp_stats[3] if fp_stats else 0,
-                "false_positive_rate": round(fp_rate * 100, 1),
-                "review_rate": round((fp_stats[3] / max(fp_stats[0], 1)) * 100, 1) if fp_stats else 0
-            },
-            "baseline_statistics": {
-                "avg_deviation": round(baseline_stats[0] * 100, 1) if baseline_stats and baseline_stats[0] else 0,
-                "max_deviation": round(baseline_stats[1] * 100, 1) if baseline_stats and baseline_stats[1] else 0,
-                "significant_deviations": baseline_stats[2] if baseline_stats else 0
+    async with acquire_conn() as conn:
+        try:
+            # Confidence distribution
+            confidence_dist = conn.execute(ADVANCED_STATS_CONFIDENCE_SQL).fetchall()
+            
+            # Action tier distribution
+            action_dist = conn.execute(ADVANCED_STATS_ACTION_SQL).fetchall()
+            
+            # False positive rate and baseline deviation stats in one pass
+            stats_row = conn.execute(ADVANCED_STATS_FEEDBACK_BASELINE_SQL).fetchone()
+            fp_stats = stats_row[:4] if stats_row else None
+            baseline_stats = stats_row[4:] if stats_row else None
+            
+            # Calculate false positive rate
+            fp_rate = 0.0
+            if fp_stats and fp_stats[3] > 0:  # reviewed_alerts > 0
+                fp_rate = fp_stats[1] / fp_stats[3]  # false_positives / reviewed_alerts
+            
+            return {
+                "confidence_distribution": [
+                    {"band": c[0], "count": c[1]} for c in confidence_dist
+                ],
+                "action_tier_distribution": [
+                    {"tier": a[0] or "Unknown", "count": a[1]} for a in action_dist
+                ],
+                "feedback_statistics": {
+                    "total_alerts": fp_stats[0] if fp_stats else 0,
+                    "false_positives": fp_stats[1] if fp_stats else 0,
+                    "confirmed_threats": fp_stats[2] if fp_stats else 0,
+                    "reviewed_alerts": fp_stats[3] if fp_stats else 0,
+                    "false_positive_rate": round(fp_rate * 100, 1),
+                    "review_rate": round((fp_stats[3] / max(fp_stats[0], 1)) * 100, 1) if fp_stats else 0
+                },
+                "baseline_statistics": {
+                    "avg_deviation": round(baseline_stats[0] * 100, 1) if baseline_stats and baseline_stats[0] else 0,
+                    "max_deviation": round(baseline_stats[1] * 100, 1) if baseline_stats and baseline_stats[1] else 0,
+                    "significant_deviations": baseline_stats[2] if baseline_stats else 0
+                }
             }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 # ============== Red Team Attack Scenarios ==============
 
@@ -1000,7 +992,13 @@ async def get_red_team_scenarios(user: dict = Depends(get_current_user)):
 
 # ============== Simulation Endpoints ==============
 
-@app.post("/api/simulation/run", response_model=SimulationResponse)
+# The engine's result is built into SimulationResponse here, so skip FastAPI's
+# second validation pass and keep the model only for the OpenAPI schema
+@app.post(
+    "/api/simulation/run",
+    response_model=None,
+    responses={200: {"model": SimulationResponse}}
+)
 async def run_simulation(
     request: SimulationRequest,
     user: dict = Depends(get_current_user_required)
@@ -1167,4 +1165,5 @@ async def train_model(user: dict = Depends(get_current_user_required)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" runs on uvloop where it is installed (not on Windows)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto")
@@ -17,18 +17,34 @@ ETHICAL CONSIDERATIONS:
 - Designed for hackathon/demo purposes only
 """
 
+import atexit
 import random
-import string
+import secrets
+import threading
 import hashlib
+import hmac
 import time
 import json
+import logging
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Tuple, List
+import re
+from collections import deque
+from datetime import datetime
+from typing import Optional, Dict, Tuple, List, Deque, Mapping
 from dataclasses import dataclass, field
 from enum import Enum
+from functools import lru_cache
+from types import MappingProxyType
 import uuid
 
+# orjson is optional; it serializes the store straight to bytes when present
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 # ============================================================================
 # SIMULATION CONFIGURATION
 # ============================================================================
@@ -67,6 +83,8 @@ class SimulationConfig:
 # Global simulation config
 SIM_CONFIG = SimulationConfig()
 
+logger = logging.getLogger(__name__)
+
 # File-based OTP store path (persists across restarts)
 OTP_STORE_FILE = os.path.join(os.path.dirname(__file__), ".otp_store.json")
 
@@ -76,35 +94,78 @@ def load_otp_store() -> Dict[str, Dict]:
         try:
             with open(OTP_STORE_FILE, 'r') as f:
                 data = json.load(f)
-                # Convert datetime strings back to datetime objects
+                # Entries written before timestamps became epoch floats hold ISO strings
                 for phone, entry in data.items():
-                    entry["created_at"] = datetime.fromisoformat(entry["created_at"])
-                    entry["expires_at"] = datetime.fromisoformat(entry["expires_at"])
+                    for key in ("created_at", "expires_at"):
+                        if isinstance(entry[key], str):
+                            entry[key] = datetime.fromisoformat(entry[key]).timestamp()
                 return data
         except Exception as e:
-            print(f"[OTP Store] Error loading: {e}")
+            logger.error("[OTP Store] Error loading: %s", e)
     return {}
 
+def flush_otp_store():
+    """Write the OTP store to file now"""
+    with _flush_lock:
+        # Every mutation of otp_store holds _store_lock, so the snapshot
+        # never sees the dict change size mid-copy
+        with _store_lock:
+            _store_dirty.clear()
+            snapshot = {phone: dict(entry) for phone, entry in otp_store.items()}
+        try:
+            # Timestamps are epoch floats, so entries serialize as-is
+            payload = _dumps(snapshot)
+            # Write a temp file and rename it over the store, so a crash
+            # mid-write never leaves a truncated store behind
+            tmp_path = OTP_STORE_FILE + ".tmp"
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+            fd = os.open(tmp_path, flags, 0o600)
+            try:
+                os.write(fd, payload)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, OTP_STORE_FILE)
+        except Exception as e:
+            logger.error("[OTP Store] Error saving: %s", e)
+            # Keep the store dirty so the writer retries on its next pass
+            _store_dirty.set()
+
 def save_otp_store():
-    """Save OTP store to file"""
-    try:
-        # Convert datetime objects to strings for JSON serialization
-        data = {}
-        for phone, entry in otp_store.items():
-            data[phone] = {
-                **entry,
-                "created_at": entry["created_at"].isoformat(),
-                "expires_at": entry["expires_at"].isoformat()
-            }
-        with open(OTP_STORE_FILE, 'w') as f:
-            json.dump(data, f)
-    except Exception as e:
-        print(f"[OTP Store] Error saving: {e}")
+    """Schedule the OTP store for saving by the background writer"""
+    _store_dirty.set()
+
+def _otp_store_writer():
+    """Coalesce store mutations into at most one write per flush interval"""
+    while True:
+        _store_dirty.wait()
+        time.sleep(OTP_STORE_FLUSH_INTERVAL)
+        flush_otp_store()
+
+def _flush_pending_otp_store():
+    """Write out mutations still waiting for the writer at shutdown"""
+    if _store_dirty.is_set():
+        flush_otp_store()
 
 # Load existing OTPs on module import (survives restarts!)
 otp_store: Dict[str, Dict] = load_otp_store()
-rate_limit_store: Dict[str, List[datetime]] = {}
-gateway_logs: List[Dict] = []
+
+# Store writes are debounced: mutations mark the store dirty and a daemon
+# thread saves it shortly after, so bursts of requests share one write
+OTP_STORE_FLUSH_INTERVAL = 0.25
+_store_dirty = threading.Event()
+# Held for every mutation of otp_store and while the writer snapshots it
+_store_lock = threading.Lock()
+# Serializes file writes between the writer thread and the exit hook
+_flush_lock = threading.Lock()
+threading.Thread(target=_otp_store_writer, name="otp-store-writer", daemon=True).start()
+atexit.register(_flush_pending_otp_store)
+
+# Per-phone OTP send times (time.monotonic_ns), bounded to the hourly quota
+rate_limit_store: Dict[str, Deque[int]] = {}
+RATE_LIMIT_WINDOW_NS = 3600 * 1_000_000_000
+# Most recent authentication events; the oldest drop off automatically
+gateway_logs: Deque[Dict] = deque(maxlen=1000)
 
 
 # ============================================================================
@@ -171,6 +232,24 @@ SYNTHETIC_USERS = [
     },
 ]
 
+# Read-only phone -> user index, built once at import. Both the index and
+# each user are proxies over private copies, so neither can be modified.
+# Entries also carry the per-user values that only depend on the phone
+# number (_user_id, _phone_masked); SYNTHETIC_USERS itself is left as is
+_USER_BY_PHONE: Mapping[str, Mapping] = MappingProxyType({
+    user["phone"]: MappingProxyType({
+        **user,
+        "_user_id": f"usr_{hashlib.md5(user['phone'].encode()).hexdigest()[:12]}",
+        "_phone_masked": f"XXXXXX{user['phone'][-4:]}",
+    })
+    for user in SYNTHETIC_USERS
+})
+
+
+def get_user_by_phone(phone: str) -> Optional[Mapping]:
+    """Look up a synthetic user by an already-normalized phone number"""
+    return _USER_BY_PHONE.get(phone)
+
 
 # ============================================================================
 # SIMULATED SMS GATEWAY
@@ -281,43 +360,77 @@ sms_gateway = SimulatedSMSGateway(SIM_CONFIG)
 # OTP AUTHENTICATION FUNCTIONS
 # ============================================================================
 
+# One-slot cache of the ISO timestamp for the current wall-clock second
+_cached_iso_second = [0, ""]
+
+
+def _iso_now() -> str:
+    """Current time as an ISO string, formatted at most once per second"""
+    second = int(time.time())
+    cached = _cached_iso_second
+    if cached[0] != second:
+        cached[1] = datetime.fromtimestamp(second).isoformat()
+        cached[0] = second
+    return cached[1]
+
+
 def generate_otp(length: int = 6) -> str:
-    """Generate a random numeric OTP"""
-    return ''.join(random.choices(string.digits, k=length))
+    """Generate a random numeric OTP using the OS CSPRNG"""
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
+
+
+# Separators dropped from phone input in a single translate() pass
+_PHONE_TRANS = str.maketrans("", "", " \t\n\r-")
+
+
+# Exactly ten ASCII digits (str.isdigit would also accept other Unicode digits)
+_is_valid_phone = re.compile(r"[0-9]{10}").fullmatch
 
 
 def clean_phone(phone: str) -> str:
     """Normalize phone number format"""
-    return phone.replace(" ", "").replace("-", "").replace("+91", "").strip()
+    phone = phone.translate(_PHONE_TRANS)
+    if phone.startswith("+91"):
+        return phone[3:]
+    return phone
+
+
+def _find_user_by_clean_phone(phone_clean: str) -> Optional[Mapping]:
+    """Find a synthetic user's read-only index entry by a normalized phone number"""
+    return get_user_by_phone(phone_clean)
 
 
 def find_user_by_phone(phone: str) -> Optional[Dict]:
     """Find a synthetic user by phone number"""
-    phone_clean = clean_phone(phone)
-    
-    for user in SYNTHETIC_USERS:
-        if user["phone"] == phone_clean:
-            return user.copy()  # Return a copy to prevent modification
-    return None
+    user = _find_user_by_clean_phone(clean_phone(phone))
+    if user is None:
+        return None
+    # Return a mutable copy without the derived index-only fields
+    return {key: value for key, value in user.items() if not key.startswith("_")}
 
 
-def check_rate_limit(phone: str) -> Tuple[bool, str]:
-    """Check if phone has exceeded rate limit"""
-    phone_clean = clean_phone(phone)
-    now = datetime.now()
-    hour_ago = now - timedelta(hours=1)
+def _check_rate_limit_clean(phone_clean: str) -> Tuple[bool, str]:
+    """Check the rate limit for a phone number that is already normalized"""
+    now = time.monotonic_ns()
     
-    # Get requests in last hour
-    if phone_clean in rate_limit_store:
-        recent = [t for t in rate_limit_store[phone_clean] if t > hour_ago]
-        rate_limit_store[phone_clean] = recent
-        
-        if len(recent) >= SIM_CONFIG.max_otp_per_phone_per_hour:
-            return False, f"Rate limit exceeded. Maximum {SIM_CONFIG.max_otp_per_phone_per_hour} OTPs per hour."
+    # Drop requests older than one hour
+    recent = rate_limit_store.get(phone_clean)
+    if recent is None:
+        return True, "OK"
+    while recent and now - recent[0] > RATE_LIMIT_WINDOW_NS:
+        recent.popleft()
+    
+    if len(recent) >= SIM_CONFIG.max_otp_per_phone_per_hour:
+        return False, f"Rate limit exceeded. Maximum {SIM_CONFIG.max_otp_per_phone_per_hour} OTPs per hour."
     
     return True, "OK"
 
 
+def check_rate_limit(phone: str) -> Tuple[bool, str]:
+    """Check if phone has exceeded rate limit"""
+    return _check_rate_limit_clean(clean_phone(phone))
+
+
 def send_otp(phone: str) -> Tuple[bool, str, Optional[str]]:
     """
     Send OTP to phone number via simulated gateway
@@ -327,26 +440,29 @@ def send_otp(phone: str) -> Tuple[bool, str, Optional[str]]:
     Note: In demo mode, OTP is returned for display. In production,
     this would NEVER return the OTP - it would only be sent via SMS.
     """
-    phone_clean = clean_phone(phone)
-    
+    return _send_otp_clean(clean_phone(phone))
+
+
+def _send_otp_clean(phone_clean: str) -> Tuple[bool, str, Optional[str]]:
+    """Send OTP to a phone number that is already normalized"""
     # Validate phone number format
-    if not phone_clean.isdigit() or len(phone_clean) != 10:
+    if not _is_valid_phone(phone_clean):
         return False, "Invalid phone number. Please enter 10 digits.", None
     
     # Check if user exists in synthetic database
-    user = find_user_by_phone(phone_clean)
+    user = _find_user_by_clean_phone(phone_clean)
     if not user:
         return False, "📱 Phone not registered in demo. Try: 9900000001 or 1234567890", None
     
     # Check rate limiting
-    rate_ok, rate_msg = check_rate_limit(phone_clean)
+    rate_ok, rate_msg = _check_rate_limit_clean(phone_clean)
     if not rate_ok:
         return False, rate_msg, None
     
     # Check cooldown
-    if phone_clean in otp_store:
-        stored = otp_store[phone_clean]
-        time_since = (datetime.now() - stored["created_at"]).seconds
+    stored = otp_store.get(phone_clean)
+    if stored is not None:
+        time_since = int(time.time() - stored["created_at"])
         if time_since < SIM_CONFIG.cooldown_seconds:
             wait = SIM_CONFIG.cooldown_seconds - time_since
             return False, f"⏱️ Please wait {wait} seconds before requesting a new OTP.", None
@@ -360,29 +476,33 @@ def send_otp(phone: str) -> Tuple[bool, str, Optional[str]]:
     if not success:
         return False, f"❌ {msg}", None
     
-    # Store OTP
-    otp_store[phone_clean] = {
+    # Store OTP (epoch seconds, since the store outlives the process)
+    now = time.time()
+    entry = {
         "otp": otp,
-        "created_at": datetime.now(),
-        "expires_at": datetime.now() + timedelta(minutes=SIM_CONFIG.otp_expiry_minutes),
+        "created_at": now,
+        "expires_at": now + SIM_CONFIG.otp_expiry_minutes * 60,
         "attempts": 0,
         "verified": False,
         "delivery_id": delivery_info.get("delivery_id")
     }
+    with _store_lock:
+        otp_store[phone_clean] = entry
     
     # Persist to file (survives server restarts)
     save_otp_store()
     
     # Update rate limit
-    if phone_clean not in rate_limit_store:
-        rate_limit_store[phone_clean] = []
-    rate_limit_store[phone_clean].append(datetime.now())
+    rate_limit_store.setdefault(
+        phone_clean, deque(maxlen=SIM_CONFIG.max_otp_per_phone_per_hour)
+    ).append(time.monotonic_ns())
     
     # Log for debugging
-    masked_phone = f"XXXXXX{phone_clean[-4:]}"
+    masked_phone = user["_phone_masked"]
     latency = delivery_info.get("latency_ms", 0)
     retries = delivery_info.get("retries", 0)
-    print(f"[SIMULATED SMS] To: {masked_phone} | OTP: {otp} | Latency: {latency}ms | Retries: {retries}")
+    logger.info("[SIMULATED SMS] To: %s | OTP: %s | Latency: %sms | Retries: %s",
+                masked_phone, otp, latency, retries)
     
     # In demo mode, return OTP for display
     demo_otp = otp if SIM_CONFIG.demo_mode else None
@@ -399,63 +519,60 @@ def verify_otp(phone: str, otp: str) -> Tuple[bool, str, Optional[Dict]]:
     phone_clean = clean_phone(phone)
     
     # Debug logging
-    print(f"[DEBUG] Verifying OTP for phone: {phone_clean}")
-    print(f"[DEBUG] Current OTP store keys: {list(otp_store.keys())}")
-    
-    # Check if OTP request exists
-    if phone_clean not in otp_store:
-        print(f"[DEBUG] Phone {phone_clean} NOT found in store!")
+    logger.debug("Verifying OTP for phone: %s", phone_clean)
+    logger.debug("OTP store size: %d", len(otp_store))
+    
+    # Take the entry out of the store up front, so two concurrent
+    # verifications of the same OTP cannot both succeed
+    with _store_lock:
+        stored = otp_store.pop(phone_clean, None)
+    if stored is None:
+        logger.debug("Phone %s not found in OTP store", phone_clean)
         return False, "❌ No OTP found. Please request a new OTP.", None
     
-    stored = otp_store[phone_clean]
-    print(f"[DEBUG] Found OTP entry, expires_at: {stored['expires_at']}")
+    save_otp_store()
+    logger.debug("Found OTP entry, expires_at: %s", stored["expires_at"])
     
     # Check expiry
-    if datetime.now() > stored["expires_at"]:
-        del otp_store[phone_clean]
-        save_otp_store()
+    if time.time() > stored["expires_at"]:
         return False, "⏰ OTP has expired. Please request a new OTP.", None
     
     # Check attempt limit
     if stored["attempts"] >= SIM_CONFIG.max_verify_attempts:
-        del otp_store[phone_clean]
-        save_otp_store()
         return False, "🚫 Too many failed attempts. Please request a new OTP.", None
     
-    # Verify OTP
-    if stored["otp"] != otp.strip():
+    # Verify OTP (constant-time, so response timing does not leak matching digits)
+    if not hmac.compare_digest(stored["otp"].encode(), otp.strip().encode()):
         stored["attempts"] += 1
+        # Put the entry back for further attempts, unless a new OTP was
+        # sent for this phone in the meantime
+        with _store_lock:
+            otp_store.setdefault(phone_clean, stored)
         save_otp_store()
         remaining = SIM_CONFIG.max_verify_attempts - stored["attempts"]
         return False, f"❌ Invalid OTP. {remaining} attempt(s) remaining.", None
     
     # Success! Get user data
-    user = find_user_by_phone(phone_clean)
+    user = _find_user_by_clean_phone(phone_clean)
     if not user:
         return False, "User not found in system.", None
     
-    # Cleanup OTP
-    del otp_store[phone_clean]
-    save_otp_store()
-    
     # Create session data (no sensitive info)
-    session_id = hashlib.sha256(f"{phone_clean}{datetime.now().isoformat()}".encode()).hexdigest()[:16]
-    
     user_data = {
-        "user_id": f"usr_{hashlib.md5(phone_clean.encode()).hexdigest()[:12]}",
-        "session_id": f"sess_{session_id}",
-        "phone_masked": f"XXXXXX{phone_clean[-4:]}",
+        "user_id": user["_user_id"],
+        "session_id": "sess_" + secrets.token_hex(8),
+        "phone_masked": user["_phone_masked"],
         "full_name": user["name"],
         "role": user["role"],
         "state": user["state"],
         "district": user["district"],
         "department": user.get("department", "AMEWS"),
-        "login_time": datetime.now().isoformat(),
+        "login_time": _iso_now(),
         "is_demo_user": True  # Always true in this simulation
     }
     
     # Log authentication
-    log_auth_event(phone_clean, True, user["state"])
+    log_auth_event(phone_clean, True, user["state"], phone_masked=user["_phone_masked"])
     
     return True, "✅ OTP verified successfully! Redirecting to dashboard...", user_data
 
@@ -465,20 +582,30 @@ def resend_otp(phone: str) -> Tuple[bool, str, Optional[str]]:
     return send_otp(phone)
 
 
-def log_auth_event(phone: str, success: bool, state: str):
+def log_auth_event(phone: str, success: bool, state: str,
+                   phone_masked: Optional[str] = None):
     """Log authentication event for audit"""
     event = {
-        "timestamp": datetime.now().isoformat(),
-        "phone_masked": f"XXXXXX{phone[-4:]}",
+        "timestamp": _iso_now(),
+        "phone_masked": phone_masked or f"XXXXXX{phone[-4:]}",
         "success": success,
         "state": state,
         "event_type": "OTP_LOGIN"
     }
     gateway_logs.append(event)
-    
-    # Keep only last 1000 logs in memory
-    if len(gateway_logs) > 1000:
-        gateway_logs.pop(0)
+
+
+# Read-only display payload for the demo users, built once from the static user table
+_DEMO_USERS_CACHE: Tuple[Mapping, ...] = tuple(
+    MappingProxyType({
+        "phone": user["phone"],
+        "name": user["name"],
+        "state": user["state"],
+        "role": user["role"],
+        "is_synthetic": True
+    })
+    for user in SYNTHETIC_USERS
+)
 
 
 def get_demo_users() -> List[Dict]:
@@ -487,25 +614,29 @@ def get_demo_users() -> List[Dict]:
     
     Returns only non-sensitive information suitable for display
     """
-    return [
-        {
-            "phone": user["phone"],
-            "name": user["name"],
-            "state": user["state"],
-            "role": user["role"],
-            "is_synthetic": True
-        }
-        for user in SYNTHETIC_USERS
-    ]
+    return [dict(user) for user in _DEMO_USERS_CACHE]
 
 
-def get_gateway_status() -> Dict:
-    """Get current simulated gateway status"""
+@lru_cache(maxsize=16)
+def _build_gateway_status(status: str, demo_mode: bool, max_per_hour: int,
+                          expiry_minutes: int) -> Dict:
+    """Build the gateway status payload for one combination of config values"""
     return {
-        "status": SIM_CONFIG.gateway_status.value,
-        "demo_mode": SIM_CONFIG.demo_mode,
-        "rate_limit": f"{SIM_CONFIG.max_otp_per_phone_per_hour}/hour",
-        "otp_expiry": f"{SIM_CONFIG.otp_expiry_minutes} minutes",
+        "status": status,
+        "demo_mode": demo_mode,
+        "rate_limit": f"{max_per_hour}/hour",
+        "otp_expiry": f"{expiry_minutes} minutes",
         "is_simulation": True,
         "disclaimer": "This is a SIMULATED gateway for demonstration purposes only."
     }
+
+
+def get_gateway_status() -> Dict:
+    """Get current simulated gateway status"""
+    # Keyed on the config values so runtime changes to SIM_CONFIG still show up
+    return _build_gateway_status(
+        SIM_CONFIG.gateway_status.value,
+        SIM_CONFIG.demo_mode,
+        SIM_CONFIG.max_otp_per_phone_per_hour,
+        SIM_CONFIG.otp_expiry_minutes
+    ).copy()
@@ -3,17 +3,36 @@ Risk Analysis Engine for AMEWS
 Combines rule-based checks with ML anomaly detection, confidence scoring, and action tiers
 """
 import json
-import uuid
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
+from enum import IntEnum
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Optional
 import numpy as np
+import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from scipy import stats
+import joblib
+from joblib import Parallel, delayed
 import pickle
 import os
 
-from app.database import get_connection, execute_query_df
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+from app.database import get_connection, execute_query_df, events_version
 from app.config import settings
 from app.baseline_engine import baseline_engine
 
@@ -21,169 +40,475 @@ from app.baseline_engine import baseline_engine
 RULE_WEIGHT = 0.6
 ML_WEIGHT = 0.4
 
+
+class Severity(IntEnum):
+    """Risk factor severity, ordered so levels compare as integers"""
+    LOW = 1
+    MEDIUM = 2
+    HIGH = 3
+    CRITICAL = 4
+
+
+@dataclass(slots=True, frozen=True)
+class RiskFactor:
+    """One triggered rule; turned into the API's dict shape by to_dict()"""
+    rule_name: str
+    contribution: float
+    description: str
+    severity: Severity
+    
+    def to_dict(self) -> Dict:
+        return {
+            "rule_name": self.rule_name,
+            "contribution": self.contribution,
+            "description": self.description,
+            "severity": self.severity.name,
+        }
+
+# Columns read by the rules, the ML features and the baseline deviation
+ANALYSIS_COLUMNS = """
+    timestamp, auth_type, service_category, state_code, retry_count,
+    is_fallback, status, hour_of_day, session_duration_ms
+"""
+
+# SQL aggregates for the 12 ML features, in _extract_features order
+ML_FEATURES_SQL = """
+    COUNT(*),
+    AVG(retry_count),
+    MAX(retry_count),
+    AVG(CAST(is_fallback AS DOUBLE)),
+    AVG(CASE WHEN status = 'FAILURE' THEN 1.0 ELSE 0.0 END),
+    STDDEV_SAMP(hour_of_day),
+    COUNT(DISTINCT state_code),
+    COUNT(DISTINCT service_category),
+    AVG(session_duration_ms),
+    STDDEV_SAMP(session_duration_ms),
+    AVG(CASE WHEN hour_of_day >= 23 OR hour_of_day <= 5 THEN 1.0 ELSE 0.0 END),
+    AVG(CASE WHEN auth_type = 'OTP' THEN 1.0 ELSE 0.0 END)
+"""
+
+# Low-cardinality string columns held as pandas categoricals, so equality
+# checks compare small integer codes instead of Python strings
+CATEGORICAL_COLUMNS = ('status', 'auth_type', 'state_code', 'service_category')
+
+
+def _coerce_dtypes(df):
+    """Convert the low-cardinality string columns of an event frame to categoricals"""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+# Off hours: 11 PM to 5 AM
+_OFF_HOURS_EXPR = "(hour_of_day >= 23) | (hour_of_day <= 5)"
+
+# numexpr only pays for its dispatch overhead on large arrays
+NUMEXPR_MIN_ROWS = 10_000
+
+
+def _off_hours_mask(hour_of_day) -> np.ndarray:
+    """Boolean array marking off-hours events, fused by numexpr on large frames"""
+    hour_of_day = np.asarray(hour_of_day)
+    if numexpr is not None and len(hour_of_day) > NUMEXPR_MIN_ROWS:
+        return numexpr.evaluate(_OFF_HOURS_EXPR, local_dict={"hour_of_day": hour_of_day})
+    return (hour_of_day >= 23) | (hour_of_day <= 5)
+
+
+def _equals(column, value) -> np.ndarray:
+    """Boolean array of column == value, compared on category codes when possible"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        if value not in categories:
+            return np.zeros(len(column), dtype=bool)
+        return column.cat.codes.to_numpy() == categories.get_loc(value)
+    return (column == value).to_numpy()
+
+
+def _category_codes(column) -> np.ndarray:
+    """Integer codes for a column's values, -1 for missing"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(dtype=np.int64)
+    return pd.factorize(column)[0].astype(np.int64)
+
+
+def _features_numpy(retry, fallback, hour, is_failure, is_otp,
+                    state_codes, service_codes, duration) -> np.ndarray:
+    """The 12 ML features of one entity's events, computed with numpy"""
+    n = len(retry)
+    off_hours = _off_hours_mask(hour)
+    return np.array([
+        n,
+        retry.mean(),
+        retry.max(),
+        fallback.mean(),
+        is_failure.mean(),
+        hour.std(ddof=1) if n > 1 else 0.0,
+        np.unique(state_codes[state_codes >= 0]).size,
+        np.unique(service_codes[service_codes >= 0]).size,
+        duration.mean(),
+        duration.std(ddof=1) if n > 1 else 0.0,
+        off_hours.mean(),
+        is_otp.mean(),
+    ])
+
+
+def _features_loop(retry, fallback, hour, is_failure, is_otp,
+                   state_codes, service_codes, duration) -> np.ndarray:
+    """Single-pass version of _features_numpy, compiled with numba when available"""
+    n = len(retry)
+    sum_retry = 0.0
+    max_retry = retry[0]
+    sum_fallback = 0.0
+    failures = 0
+    off_hours = 0
+    otp = 0
+    sum_hour = 0.0
+    sum_duration = 0.0
+    state_seen = np.zeros(max(state_codes.max() + 1, 1), dtype=np.bool_)
+    service_seen = np.zeros(max(service_codes.max() + 1, 1), dtype=np.bool_)
+    for i in range(n):
+        sum_retry += retry[i]
+        if retry[i] > max_retry:
+            max_retry = retry[i]
+        sum_fallback += fallback[i]
+        if is_failure[i]:
+            failures += 1
+        if is_otp[i]:
+            otp += 1
+        if hour[i] >= 23 or hour[i] <= 5:
+            off_hours += 1
+        sum_hour += hour[i]
+        sum_duration += duration[i]
+        if state_codes[i] >= 0:
+            state_seen[state_codes[i]] = True
+        if service_codes[i] >= 0:
+            service_seen[service_codes[i]] = True
+    
+    mean_hour = sum_hour / n
+    mean_duration = sum_duration / n
+    hour_std = 0.0
+    duration_std = 0.0
+    if n > 1:
+        sq_hour = 0.0
+        sq_duration = 0.0
+        for i in range(n):
+            sq_hour += (hour[i] - mean_hour) ** 2
+            sq_duration += (duration[i] - mean_duration) ** 2
+        hour_std = np.sqrt(sq_hour / (n - 1))
+        duration_std = np.sqrt(sq_duration / (n - 1))
+    
+    out = np.empty(12)
+    out[0] = n
+    out[1] = sum_retry / n
+    out[2] = max_retry
+    out[3] = sum_fallback / n
+    out[4] = failures / n
+    out[5] = hour_std
+    out[6] = state_seen.sum()
+    out[7] = service_seen.sum()
+    out[8] = mean_duration
+    out[9] = duration_std
+    out[10] = off_hours / n
+    out[11] = otp / n
+    return out
+
+
+# numba is optional: the compiled loop avoids numpy's per-call overhead on the
+# small per-entity frames, and numpy covers installs without it
+if njit is not None:
+    _features_kernel = njit(cache=True)(_features_loop)
+else:
+    _features_kernel = _features_numpy
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    One declarative risk rule over the scalar metrics from _precompute
+    
+    The rule fires when applies(m) holds and metric(m) > threshold. It then
+    contributes min(cap, m[value] * scale), or the full cap when value is None,
+    and its description template is formatted with the metrics.
+    """
+    name: str
+    metric: Callable[[Dict], float]
+    threshold: float
+    value: Optional[str]
+    scale: float
+    cap: float
+    severity: Callable[[Dict], Severity]
+    description: str
+    applies: Optional[Callable[[Dict], bool]] = None
+
+
+RULES = [
+    # More than 20 events per hour from same entity
+    Rule(
+        "HIGH_AUTH_FREQUENCY",
+        metric=lambda m: m['events_per_hour'],
+        threshold=20,
+        value='events_per_hour', scale=1, cap=30,
+        severity=lambda m: Severity.HIGH if m['events_per_hour'] > 50 else Severity.MEDIUM,
+        description="Excessive authentication rate: {events_per_hour:.1f} events/hour",
+    ),
+    # More than 2 different states per hour (impossible travel)
+    Rule(
+        "GEOGRAPHIC_VELOCITY_ANOMALY",
+        metric=lambda m: m['states_per_hour'],
+        threshold=2,
+        value='states_per_hour', scale=5, cap=25,
+        severity=lambda m: Severity.HIGH,
+        description="Rapid location changes: {unique_states} states in {time_span_hours:.1f} hours",
+        applies=lambda m: m['n'] >= 2,
+    ),
+    # More than 30% OTP fallbacks
+    Rule(
+        "OTP_FALLBACK_ABUSE",
+        metric=lambda m: m['fallback_ratio'],
+        threshold=0.3,
+        value='fallback_ratio', scale=40, cap=20,
+        severity=lambda m: Severity.HIGH if m['fallback_ratio'] > 0.5 else Severity.MEDIUM,
+        description="High OTP fallback rate: {fallback_ratio:.1%} of authentications",
+        applies=lambda m: m['has_otp'],
+    ),
+    # Average above 2 retries, or more than 20% of events with 3+ retries
+    Rule(
+        "ABNORMAL_RETRY_PATTERN",
+        metric=lambda m: max(m['avg_retries'] - 2, m['high_retry_events'] - m['n'] * 0.2),
+        threshold=0,
+        value='avg_retries', scale=5, cap=15,
+        severity=lambda m: Severity.MEDIUM if m['avg_retries'] < 4 else Severity.HIGH,
+        description="Excessive retries: avg {avg_retries:.1f}, {high_retry_events} high-retry events",
+    ),
+    # More than 40% of events during off-hours (11PM-5AM)
+    Rule(
+        "OFF_HOURS_ACTIVITY",
+        metric=lambda m: m['off_hours_ratio'],
+        threshold=0.4,
+        value='off_hours_ratio', scale=30, cap=15,
+        severity=lambda m: Severity.MEDIUM,
+        description="Unusual timing: {off_hours_ratio:.1%} of events during off-hours (11PM-5AM)",
+    ),
+    # More than 30% failures
+    Rule(
+        "HIGH_FAILURE_RATE",
+        metric=lambda m: m['failure_rate'],
+        threshold=0.3,
+        value='failure_rate', scale=40, cap=20,
+        severity=lambda m: Severity.HIGH if m['failure_rate'] > 0.5 else Severity.MEDIUM,
+        description="High failure rate: {failure_rate:.1%} of authentications failed",
+    ),
+    # Very short (under 200ms) or very long (over 30s) sessions
+    Rule(
+        "SESSION_DURATION_ANOMALY",
+        metric=lambda m: max(200 - m['avg_duration'], m['avg_duration'] - 30000),
+        threshold=0,
+        value=None, scale=1, cap=10,
+        severity=lambda m: Severity.LOW,
+        description="Unusual session duration: avg {avg_duration:.0f}ms",
+        applies=lambda m: m['avg_duration'] is not None,
+    ),
+]
+
+
 class RuleBasedAnalyzer:
     """Rule-based risk analysis component"""
     
     def __init__(self):
-        self.rules = [
-            self.check_auth_frequency,
-            self.check_geographic_velocity,
-            self.check_otp_fallback_abuse,
-            self.check_retry_loops,
-            self.check_off_hours_activity,
-            self.check_failure_rate,
-            self.check_session_duration_anomaly,
-        ]
+        self.rules = RULES
+        self._thresholds = np.array([rule.threshold for rule in self.rules], dtype=np.float64)
+        self._scales = np.array([rule.scale for rule in self.rules], dtype=np.float64)
+        self._caps = np.array([rule.cap for rule in self.rules], dtype=np.float64)
     
-    def analyze(self, events_df) -> List[Dict]:
+    def analyze(self, events_df) -> List[RiskFactor]:
         """Run all rules and return risk factors"""
-        risk_factors = []
+        if events_df.empty:
+            return []
+        
+        # Every rule reads the same few scalar metrics; compute them once
+        metrics = self._precompute(events_df)
         
-        for rule in self.rules:
+        # Rules that do not apply, or fail, get a metric that never fires
+        values = np.empty(len(self.rules))
+        bases = np.empty(len(self.rules))
+        for i, rule in enumerate(self.rules):
             try:
-                result = rule(events_df)
-                if result:
-                    risk_factors.append(result)
+                if rule.applies is not None and not rule.applies(metrics):
+                    values[i] = -np.inf
+                else:
+                    values[i] = rule.metric(metrics)
+                bases[i] = metrics[rule.value] if rule.value is not None else np.inf
             except Exception as e:
-                print(f"Rule {rule.__name__} failed: {e}")
-        
-        return risk_factors
-    
-    def check_auth_frequency(self, df) -> Optional[Dict]:
-        """Check for excessive authentication frequency"""
-        if df.empty:
-            return None
-            
-        # Group by device and count events per hour
-        time_range_hours = max((df['timestamp'].max() - df['timestamp'].min()).total_seconds() / 3600, 1)
-        events_per_hour = len(df) / time_range_hours
-        
-        # Threshold: More than 20 events per hour from same entity
-        if events_per_hour > 20:
-            severity = "HIGH" if events_per_hour > 50 else "MEDIUM"
-            return {
-                "rule_name": "HIGH_AUTH_FREQUENCY",
-                "contribution": min(30, events_per_hour),
-                "description": f"Excessive authentication rate: {events_per_hour:.1f} events/hour",
-                "severity": severity
-            }
-        return None
+                print(f"Rule {rule.name} failed: {e}")
+                values[i] = -np.inf
+        
+        # All contribution caps in one pass; only fired rules are formatted
+        contributions = np.minimum(self._caps, bases * self._scales)
+        return [
+            RiskFactor(
+                self.rules[i].name,
+                float(contributions[i]),
+                self.rules[i].description.format(**metrics),
+                self.rules[i].severity(metrics)
+            )
+            for i in np.flatnonzero(values > self._thresholds)
+        ]
     
-    def check_geographic_velocity(self, df) -> Optional[Dict]:
-        """Check for rapid geographic changes (impossible travel)"""
-        if len(df) < 2:
-            return None
-        
-        df_sorted = df.sort_values('timestamp')
-        unique_states = df_sorted['state_code'].nunique()
-        time_span_hours = max((df_sorted['timestamp'].max() - df_sorted['timestamp'].min()).total_seconds() / 3600, 0.1)
-        
-        # If accessing from multiple states in short time
-        states_per_hour = unique_states / time_span_hours
-        
-        if states_per_hour > 2:  # More than 2 different states per hour
-            return {
-                "rule_name": "GEOGRAPHIC_VELOCITY_ANOMALY",
-                "contribution": min(25, states_per_hour * 5),
-                "description": f"Rapid location changes: {unique_states} states in {time_span_hours:.1f} hours",
-                "severity": "HIGH"
-            }
-        return None
+    @staticmethod
+    def _precompute(df) -> Dict:
+        """Reduce an event frame to the scalar metrics the rules compare"""
+        n = len(df)
+        span_seconds = RuleBasedAnalyzer._span_seconds(df['timestamp'].to_numpy())
+        time_span_hours = max(span_seconds / 3600, 0.1)
+        unique_states = df['state_code'].nunique()
+        retries = df['retry_count'].to_numpy()
+        
+        metrics = {
+            "n": n,
+            "events_per_hour": n / max(span_seconds / 3600, 1),
+            "unique_states": unique_states,
+            "time_span_hours": time_span_hours,
+            "states_per_hour": unique_states / time_span_hours,
+            "has_otp": _equals(df['auth_type'], 'OTP').any(),
+            "fallback_ratio": (df['is_fallback'].to_numpy() == True).sum() / n,
+            "avg_retries": retries.mean(),
+            "high_retry_events": int((retries >= 3).sum()),
+            "off_hours_ratio": _off_hours_mask(df['hour_of_day'].to_numpy()).sum() / n,
+            "failure_rate": _equals(df['status'], 'FAILURE').sum() / n,
+            "avg_duration": None,
+        }
+        if 'session_duration_ms' in df.columns:
+            metrics["avg_duration"] = df['session_duration_ms'].to_numpy().mean()
+        return metrics
     
-    def check_otp_fallback_abuse(self, df) -> Optional[Dict]:
-        """Check for excessive OTP fallback usage"""
-        if df.empty:
-            return None
-        
-        otp_events = df[df['auth_type'] == 'OTP']
-        fallback_events = df[df['is_fallback'] == True]
-        
-        if len(otp_events) == 0:
-            return None
-            
-        fallback_ratio = len(fallback_events) / len(df)
-        
-        if fallback_ratio > 0.3:  # More than 30% fallbacks
-            severity = "HIGH" if fallback_ratio > 0.5 else "MEDIUM"
-            return {
-                "rule_name": "OTP_FALLBACK_ABUSE",
-                "contribution": min(20, fallback_ratio * 40),
-                "description": f"High OTP fallback rate: {fallback_ratio*100:.1f}% of authentications",
-                "severity": severity
-            }
-        return None
+    @staticmethod
+    def _span_seconds(timestamps: np.ndarray) -> float:
+        """Seconds between the earliest and latest event"""
+        return (timestamps.max() - timestamps.min()) / np.timedelta64(1, 's')
+
+
+def _average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Average path length of an unsuccessful BST search over n samples, c(n)"""
+    n = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n)
+    lengths[n == 2] = 1.0
+    many = n > 2
+    lengths[many] = 2.0 * (np.log(n[many] - 1.0) + np.euler_gamma) - 2.0 * (n[many] - 1.0) / n[many]
+    return lengths
+
+
+def _forest_depths_loop(X, feature, threshold, left, right, path_length, roots) -> np.ndarray:
+    """Summed path length of each row over all trees, walking one row at a time"""
+    depths = np.zeros(X.shape[0])
+    for i in range(X.shape[0]):
+        total = 0.0
+        for root in roots:
+            node = root
+            # Leaves are the nodes that loop back to themselves
+            while left[node] != node:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            total += path_length[node]
+        depths[i] = total
+    return depths
+
+
+# Compiled walk stops at each row's leaf; without numba the vectorized walk
+# in FlatIsolationForest is faster than an interpreted loop
+_forest_depths_kernel = njit(cache=True)(_forest_depths_loop) if njit is not None else None
+
+
+def _float32_floor(values: np.ndarray) -> np.ndarray:
+    """
+    Largest float32 at or below each value
     
-    def check_retry_loops(self, df) -> Optional[Dict]:
-        """Check for abnormal retry patterns"""
-        if df.empty:
-            return None
-        
-        avg_retries = df['retry_count'].mean()
-        high_retry_events = len(df[df['retry_count'] >= 3])
-        
-        if avg_retries > 2 or high_retry_events > len(df) * 0.2:
-            severity = "MEDIUM" if avg_retries < 4 else "HIGH"
-            return {
-                "rule_name": "ABNORMAL_RETRY_PATTERN",
-                "contribution": min(15, avg_retries * 5),
-                "description": f"Excessive retries: avg {avg_retries:.1f}, {high_retry_events} high-retry events",
-                "severity": severity
-            }
-        return None
+    For any float32 x, x <= t holds exactly when x <= _float32_floor(t), so
+    float32 thresholds send float32 rows down the same branches as float64.
+    """
+    rounded = np.asarray(values).astype(np.float32)
+    too_high = rounded > values
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+class FlatIsolationForest:
+    """
+    Array-based scorer for a fitted IsolationForest
     
-    def check_off_hours_activity(self, df) -> Optional[Dict]:
-        """Check for authentication during unusual hours"""
-        if df.empty:
-            return None
-        
-        # Off hours: 11 PM to 5 AM
-        off_hours_events = df[(df['hour_of_day'] >= 23) | (df['hour_of_day'] <= 5)]
-        off_hours_ratio = len(off_hours_events) / len(df)
-        
-        if off_hours_ratio > 0.4:  # More than 40% off-hours
-            return {
-                "rule_name": "OFF_HOURS_ACTIVITY",
-                "contribution": min(15, off_hours_ratio * 30),
-                "description": f"Unusual timing: {off_hours_ratio*100:.1f}% of events during off-hours (11PM-5AM)",
-                "severity": "MEDIUM"
-            }
-        return None
+    Every tree is packed into one set of flat node arrays, so a batch of rows
+    walks all trees together in a fixed number of vectorized steps instead of
+    one sklearn apply() call per tree. Scores match decision_function.
+    """
     
-    def check_failure_rate(self, df) -> Optional[Dict]:
-        """Check for abnormal failure rates"""
-        if df.empty:
-            return None
-        
-        failures = df[df['status'] == 'FAILURE']
-        failure_rate = len(failures) / len(df)
-        
-        if failure_rate > 0.3:  # More than 30% failures
-            severity = "HIGH" if failure_rate > 0.5 else "MEDIUM"
-            return {
-                "rule_name": "HIGH_FAILURE_RATE",
-                "contribution": min(20, failure_rate * 40),
-                "description": f"High failure rate: {failure_rate*100:.1f}% of authentications failed",
-                "severity": severity
-            }
-        return None
+    def __init__(self, model: IsolationForest):
+        subsample_features = model._max_features != model.n_features_in_
+        features, thresholds, lefts, rights, path_lengths, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        
+        for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            
+            # Trees fitted on a feature subset index into that subset
+            feature = np.asarray(tree.feature, dtype=np.intp).copy()
+            if subsample_features:
+                feature[~is_leaf] = np.asarray(estimator_features)[feature[~is_leaf]]
+            feature[is_leaf] = 0
+            
+            # Leaves loop back to themselves so extra steps leave rows in place
+            threshold = np.where(is_leaf, np.inf, tree.threshold)
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+            
+            # Root has depth 1 here; a leaf scores depth-from-root + c(samples)
+            depths = tree.compute_node_depths() - 1
+            path_length = depths + _average_path_length(tree.n_node_samples)
+            
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(left)
+            rights.append(right)
+            path_lengths.append(path_length)
+            roots.append(offset)
+            max_depth = max(max_depth, int(depths[is_leaf].max()))
+            offset += tree.node_count
+        
+        self._feature = np.concatenate(features)
+        self._threshold = _float32_floor(np.concatenate(thresholds))
+        self._left = np.concatenate(lefts)
+        self._right = np.concatenate(rights)
+        self._path_length = np.concatenate(path_lengths)
+        self._roots = np.array(roots, dtype=np.intp)
+        self._max_depth = max_depth
+        self._denominator = len(roots) * _average_path_length([model.max_samples_])[0]
+        self._offset = model.offset_
     
-    def check_session_duration_anomaly(self, df) -> Optional[Dict]:
-        """Check for abnormal session durations"""
-        if df.empty or 'session_duration_ms' not in df.columns:
-            return None
-        
-        avg_duration = df['session_duration_ms'].mean()
-        std_duration = df['session_duration_ms'].std()
-        
-        # Very short or very long sessions
-        if avg_duration < 200 or avg_duration > 30000:
-            return {
-                "rule_name": "SESSION_DURATION_ANOMALY",
-                "contribution": 10,
-                "description": f"Unusual session duration: avg {avg_duration:.0f}ms",
-                "severity": "LOW"
-            }
-        return None
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Anomaly score per row; negative values are outliers"""
+        # Rows are float32 like in sklearn; floored float32 thresholds keep its branches
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        
+        if _forest_depths_kernel is not None:
+            depths = _forest_depths_kernel(X, self._feature, self._threshold, self._left,
+                                           self._right, self._path_length, self._roots)
+        else:
+            rows = np.arange(X.shape[0])
+            node = np.repeat(self._roots[:, None], X.shape[0], axis=1)
+            for _ in range(self._max_depth):
+                go_left = X[rows, self._feature[node]] <= self._threshold[node]
+                node = np.where(go_left, self._left[node], self._right[node])
+            depths = self._path_length[node].sum(axis=0)
+        
+        if self._denominator == 0:
+            scores = np.full(X.shape[0], 0.5)
+        else:
+            scores = 2 ** (-depths / self._denominator)
+        return -scores - self._offset
 
 
 class MLAnomalyDetector:
@@ -192,6 +517,9 @@ class MLAnomalyDetector:
     def __init__(self):
         self.model = None
         self.scaler = StandardScaler()
+        self._flat_forest = None
+        self._scaler_mean = None
+        self._scaler_inv_scale = None
         self.model_path = os.path.join(os.path.dirname(__file__), "..", "models", "isolation_forest.pkl")
         self.scaler_path = os.path.join(os.path.dirname(__file__), "..", "models", "scaler.pkl")
         self._load_or_create_model()
@@ -200,18 +528,54 @@ class MLAnomalyDetector:
         """Load existing model or create new one"""
         try:
             if os.path.exists(self.model_path):
-                with open(self.model_path, 'rb') as f:
-                    self.model = pickle.load(f)
-                with open(self.scaler_path, 'rb') as f:
-                    self.scaler = pickle.load(f)
+                self.model = self._load_artifact(self.model_path)
+                self.scaler = self._load_artifact(self.scaler_path)
+                self._compile_forest()
+                self._cache_scaler()
             else:
                 self._create_new_model()
         except Exception as e:
             print(f"Error loading model: {e}")
             self._create_new_model()
     
+    @staticmethod
+    def _load_artifact(path: str):
+        """
+        Load a saved model or scaler
+        
+        joblib memory-maps the numpy arrays read-only, so workers forked after
+        the module-level engine is created share those pages. Files written
+        with plain pickle by older versions are still accepted.
+        """
+        try:
+            return joblib.load(path, mmap_mode='r')
+        except Exception:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    
+    def _compile_forest(self):
+        """Flatten the fitted forest for fast scoring, keeping sklearn as fallback"""
+        try:
+            self._flat_forest = FlatIsolationForest(self.model)
+        except Exception as e:
+            print(f"Could not flatten isolation forest: {e}")
+            self._flat_forest = None
+    
+    def _cache_scaler(self):
+        """Keep the fitted scaler's mean and reciprocal scale for inline scaling"""
+        mean = getattr(self.scaler, 'mean_', None)
+        scale = getattr(self.scaler, 'scale_', None)
+        if mean is None or scale is None:
+            self._scaler_mean = None
+            self._scaler_inv_scale = None
+            return
+        self._scaler_mean = np.asarray(mean, dtype=np.float32)
+        self._scaler_inv_scale = (1.0 / np.asarray(scale, dtype=np.float64)).astype(np.float32)
+    
     def _create_new_model(self):
         """Create a new Isolation Forest model"""
+        self._flat_forest = None
+        self._cache_scaler()
         self.model = IsolationForest(
             n_estimators=100,
             contamination=0.05,  # Expected 5% anomalies
@@ -219,54 +583,65 @@ class MLAnomalyDetector:
             n_jobs=-1
         )
     
-    def _extract_features(self, df) -> np.ndarray:
-        """Extract features for ML model"""
+    def _extract_features(self, df, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Extract features for ML model, optionally into a caller-owned row of 12"""
         if df.empty:
             return np.array([])
         
-        features = []
-        
-        # Aggregate features
-        features.append(len(df))  # Event count
-        features.append(df['retry_count'].mean())
-        features.append(df['retry_count'].max())
-        features.append(df['is_fallback'].mean())
-        features.append(len(df[df['status'] == 'FAILURE']) / max(len(df), 1))
-        features.append(df['hour_of_day'].std() if len(df) > 1 else 0)
-        features.append(df['state_code'].nunique())
-        features.append(df['service_category'].nunique())
-        features.append(df['session_duration_ms'].mean())
-        features.append(df['session_duration_ms'].std() if len(df) > 1 else 0)
-        
-        # Off-hours ratio
-        off_hours = len(df[(df['hour_of_day'] >= 23) | (df['hour_of_day'] <= 5)])
-        features.append(off_hours / max(len(df), 1))
-        
-        # OTP ratio
-        otp_events = len(df[df['auth_type'] == 'OTP'])
-        features.append(otp_events / max(len(df), 1))
-        
-        return np.array(features).reshape(1, -1)
+        features = _features_kernel(
+            df['retry_count'].to_numpy(dtype=np.float64),
+            df['is_fallback'].to_numpy(dtype=np.float64),
+            df['hour_of_day'].to_numpy(dtype=np.float64),
+            _equals(df['status'], 'FAILURE'),
+            _equals(df['auth_type'], 'OTP'),
+            _category_codes(df['state_code']),
+            _category_codes(df['service_category']),
+            df['session_duration_ms'].to_numpy(dtype=np.float64),
+        )
+        if out is not None:
+            out[:] = features
+            return out
+        return features.reshape(1, -1)
     
     def train(self, training_data_df):
         """Train the model on normal behavior data"""
         if training_data_df.empty:
             return
         
-        # Group by device and extract features for each
-        feature_list = []
-        devices = training_data_df['device_fingerprint_hash'].unique()
+        # Limit for performance: the first 1000 devices seen
+        devices = training_data_df['device_fingerprint_hash'].unique()[:1000]
+        df = training_data_df[training_data_df['device_fingerprint_hash'].isin(devices)]
         
-        for device in devices[:1000]:  # Limit for performance
-            device_df = training_data_df[training_data_df['device_fingerprint_hash'] == device]
-            features = self._extract_features(device_df)
-            if features.size > 0:
-                feature_list.append(features.flatten())
+        # Build the same 12 features as _extract_features for every device in
+        # one groupby pass; boolean helper columns turn ratios into means
+        df = df.assign(
+            _is_failure=df['status'].eq('FAILURE'),
+            _off_hours=_off_hours_mask(df['hour_of_day'].to_numpy()),
+            _is_otp=df['auth_type'].eq('OTP'),
+        )
+        features = df.groupby('device_fingerprint_hash', sort=False).agg(
+            event_count=('retry_count', 'size'),
+            retry_mean=('retry_count', 'mean'),
+            retry_max=('retry_count', 'max'),
+            fallback_rate=('is_fallback', 'mean'),
+            failure_rate=('_is_failure', 'mean'),
+            hour_std=('hour_of_day', 'std'),
+            unique_states=('state_code', 'nunique'),
+            unique_services=('service_category', 'nunique'),
+            duration_mean=('session_duration_ms', 'mean'),
+            duration_std=('session_duration_ms', 'std'),
+            off_hours_rate=('_off_hours', 'mean'),
+            otp_rate=('_is_otp', 'mean'),
+        )
         
-        if not feature_list:
+        self.fit_features(features.to_numpy(dtype=float))
+    
+    def fit_features(self, X: np.ndarray):
+        """Train the model on a per-entity feature matrix (one row per entity)"""
+        if len(X) == 0:
             return
-            
-        X = np.array(feature_list)
+        
+        # Single-event entities have NaN std; they count as 0 like in _extract_features
         X = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
         
         # Fit scaler and transform
@@ -274,84 +649,256 @@ class MLAnomalyDetector:
         
         # Train model
         self.model.fit(X_scaled)
+        self._compile_forest()
+        self._cache_scaler()
         
-        # Save model
+        # Save model; joblib writes the numpy arrays raw after the protocol 5
+        # pickle stream, so _load_artifact can memory-map them without copying
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-        with open(self.model_path, 'wb') as f:
-            pickle.dump(self.model, f)
-        with open(self.scaler_path, 'wb') as f:
-            pickle.dump(self.scaler, f)
+        joblib.dump(self.model, self.model_path, compress=0, protocol=pickle.HIGHEST_PROTOCOL)
+        joblib.dump(self.scaler, self.scaler_path, compress=0, protocol=pickle.HIGHEST_PROTOCOL)
     
     def predict_anomaly_score(self, df) -> Tuple[float, float]:
         """
         Predict anomaly score for given events
         Returns: (anomaly_score 0-100, confidence 0-1)
         """
-        if df.empty:
-            return 0.0, 0.0
+        return self.predict_anomaly_scores([df])[0]
+    
+    def predict_anomaly_scores(self, dfs: List) -> List[Tuple[float, float]]:
+        """
+        Predict anomaly scores for several event frames at once
         
-        features = self._extract_features(df)
-        if features.size == 0:
-            return 0.0, 0.0
+        Feature rows are stacked so the scaler and the forest each run once for
+        the whole batch. Returns one (anomaly_score 0-100, confidence 0-1) per frame.
+        """
+        results = [(0.0, 0.0)] * len(dfs)
+        
+        # One feature matrix per call, filled row by row and then sanitized and
+        # scaled in place; it is never shared, so concurrent requests are safe
+        features = np.empty((len(dfs), 12), dtype=np.float32)
+        positions = []
+        for i, df in enumerate(dfs):
+            if df.empty:
+                continue
+            self._extract_features(df, out=features[len(positions)])
+            positions.append(i)
+        
+        if not positions:
+            return results
         
-        features = np.nan_to_num(features, nan=0.0, posinf=0.0, neginf=0.0)
+        features = features[:len(positions)]
+        np.nan_to_num(features, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
         
         try:
             # Check if scaler is fitted
-            if not hasattr(self.scaler, 'mean_') or self.scaler.mean_ is None:
+            if self._scaler_mean is None:
                 # Use Z-score fallback if model not trained
-                return self._zscore_fallback(df)
+                for i in positions:
+                    results[i] = self._zscore_fallback(dfs[i])
+                return results
             
-            features_scaled = self.scaler.transform(features)
+            # StandardScaler.transform without its input validation or copy
+            features_scaled = np.subtract(features, self._scaler_mean, out=features)
+            np.multiply(features_scaled, self._scaler_inv_scale, out=features_scaled)
             
-            # Get anomaly score (-1 for anomaly, 1 for normal)
-            raw_score = self.model.decision_function(features_scaled)[0]
-            
-            # Convert to 0-100 scale (lower decision function = more anomalous)
-            # Typical range is -0.5 to 0.5
-            anomaly_score = max(0, min(100, 50 - raw_score * 100))
+            # Get anomaly scores (-1 for anomaly, 1 for normal)
+            if self._flat_forest is not None:
+                raw_scores = self._flat_forest.decision_function(features_scaled)
+            else:
+                raw_scores = self.model.decision_function(features_scaled)
             
-            # Confidence based on distance from threshold
-            confidence = min(1.0, abs(raw_score) * 2)
+            for i, raw_score in zip(positions, raw_scores):
+                # Convert to 0-100 scale (lower decision function = more anomalous)
+                # Typical range is -0.5 to 0.5
+                anomaly_score = max(0, min(100, 50 - raw_score * 100))
+                
+                # Confidence based on distance from threshold
+                confidence = min(1.0, abs(raw_score) * 2)
+                
+                results[i] = (anomaly_score, confidence)
             
-            return anomaly_score, confidence
+            return results
             
         except Exception as e:
             print(f"ML prediction error: {e}")
-            return self._zscore_fallback(df)
+            for i in positions:
+                results[i] = self._zscore_fallback(dfs[i])
+            return results
+    
+    # Z-score fallback metrics: retry mean, failure rate, off-hours ratio
+    _ZSCORE_TRIGGERS = np.array([1.0, 0.1, 0.2])
+    _ZSCORE_SCALES = np.array([1.0, 10.0, 5.0])
     
     def _zscore_fallback(self, df) -> Tuple[float, float]:
         """Fallback to Z-score based anomaly detection"""
         if df.empty:
             return 0.0, 0.0
         
-        # Calculate z-scores for key metrics
-        z_scores = []
-        
-        # Retry count
-        if df['retry_count'].mean() > 1:
-            z_scores.append(min(3, df['retry_count'].mean()))
-        
-        # Failure rate
-        failure_rate = len(df[df['status'] == 'FAILURE']) / len(df)
-        if failure_rate > 0.1:
-            z_scores.append(min(3, failure_rate * 10))
-        
-        # Off hours ratio
-        off_hours = len(df[(df['hour_of_day'] >= 23) | (df['hour_of_day'] <= 5)]) / len(df)
-        if off_hours > 0.2:
-            z_scores.append(min(3, off_hours * 5))
-        
-        if not z_scores:
+        # Calculate z-scores for key metrics from the same values the rules use
+        prepared = RuleBasedAnalyzer._precompute(df)
+        metrics = np.array([
+            prepared['avg_retries'],
+            prepared['failure_rate'],
+            prepared['off_hours_ratio'],
+        ])
+        
+        # Only metrics above their trigger contribute, each capped at 3
+        triggered = metrics > self._ZSCORE_TRIGGERS
+        if not triggered.any():
             return 0.0, 0.5
         
-        avg_zscore = np.mean(z_scores)
+        z_scores = np.minimum(3, metrics * self._ZSCORE_SCALES)
+        avg_zscore = z_scores[triggered].mean()
         anomaly_score = min(100, avg_zscore * 25)
         confidence = 0.6  # Lower confidence for fallback
         
         return anomaly_score, confidence
 
 
+# Column identifying each entity type in authentication_events
+ENTITY_COLUMNS = {
+    "DEVICE": "device_fingerprint_hash",
+    "REGION": "state_code",
+    "SERVICE_PROVIDER": "service_provider_id",
+}
+
+# Event lookups per entity type; only the analysed columns are transferred
+# and no consumer needs row order
+ENTITY_EVENT_QUERIES = {
+    entity_type: f"""
+        SELECT {ANALYSIS_COLUMNS} FROM authentication_events
+        WHERE {column} = ? AND timestamp >= ?
+    """
+    for entity_type, column in ENTITY_COLUMNS.items()
+}
+
+# Entity ids bound per IN (...) lookup, well under embedded SQL parameter limits
+IN_QUERY_CHUNK_SIZE = 900
+
+# Memory budget for the entity windows kept by _fetch_entity_events
+EVENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# (entity_type, entity_id, hours, minute, version) -> (frame, size in bytes),
+# least recently used first
+_event_cache: 'OrderedDict[tuple, Tuple[pd.DataFrame, int]]' = OrderedDict()
+_event_cache_bytes = 0
+_event_cache_lock = threading.Lock()
+
+
+def _fetch_entity_events(entity_type: str, entity_id: str, time_window_hours: int,
+                         minute: int, version: int) -> 'pd.DataFrame':
+    """
+    Events of one entity in the window ending at the given minute
+    
+    Keyed on the minute and the events write version, so repeated analyses of
+    the same entity during an incident reuse one query until either changes.
+    Cached frames are evicted least recently used first once they exceed
+    EVENT_CACHE_MAX_BYTES, and each caller gets its own copy to modify freely.
+    """
+    global _event_cache_bytes
+    key = (entity_type, entity_id, time_window_hours, minute, version)
+    with _event_cache_lock:
+        cached = _event_cache.get(key)
+        if cached is not None:
+            _event_cache.move_to_end(key)
+            return cached[0].copy()
+    
+    query = ENTITY_EVENT_QUERIES.get(entity_type)
+    if query is None:
+        return execute_query_df(f"SELECT {ANALYSIS_COLUMNS} FROM authentication_events WHERE 1=0")
+    
+    start_time = datetime.fromtimestamp(minute * 60) - timedelta(hours=time_window_hours)
+    events = _coerce_dtypes(execute_query_df(query, (entity_id, start_time)))
+    
+    size = int(events.memory_usage(deep=True).sum())
+    if size <= EVENT_CACHE_MAX_BYTES:
+        with _event_cache_lock:
+            if key not in _event_cache:
+                _event_cache[key] = (events, size)
+                _event_cache_bytes += size
+                while _event_cache_bytes > EVENT_CACHE_MAX_BYTES:
+                    _, (_, evicted_size) = _event_cache.popitem(last=False)
+                    _event_cache_bytes -= evicted_size
+    return events.copy()
+
+
+def _fetch_entities_events(entity_type: str, entity_ids: List[str],
+                           time_window_hours: int, minute: int) -> Dict[str, 'pd.DataFrame']:
+    """
+    Events of several entities of one type, split into one frame per entity
+    
+    Ids are looked up with IN (...) queries of at most IN_QUERY_CHUNK_SIZE,
+    over the same window as _fetch_entity_events. Entities without events get
+    an empty frame.
+    """
+    column = ENTITY_COLUMNS.get(entity_type)
+    unique_ids = list(dict.fromkeys(entity_ids))
+    if column is None or not unique_ids:
+        empty = execute_query_df(f"SELECT {ANALYSIS_COLUMNS} FROM authentication_events WHERE 1=0")
+        return {entity_id: empty for entity_id in unique_ids}
+    
+    start_time = datetime.fromtimestamp(minute * 60) - timedelta(hours=time_window_hours)
+    chunks = []
+    for i in range(0, len(unique_ids), IN_QUERY_CHUNK_SIZE):
+        chunk = unique_ids[i:i + IN_QUERY_CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        chunks.append(execute_query_df(f"""
+            SELECT {ANALYSIS_COLUMNS}, {column} AS entity_id FROM authentication_events
+            WHERE {column} IN ({placeholders}) AND timestamp >= ?
+        """, (*chunk, start_time)))
+    events = _coerce_dtypes(pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0])
+    
+    frames = {
+        entity_id: group.drop(columns="entity_id")
+        for entity_id, group in events.groupby("entity_id", sort=False)
+    }
+    empty = events.iloc[:0].drop(columns="entity_id")
+    return {entity_id: frames.get(entity_id, empty) for entity_id in unique_ids}
+
+
+# Baseline results are reused within a minute for the same entity and metrics
+BASELINE_CACHE_SIZE = 10_000
+
+# The system baseline status only changes on the scale of retraining
+SYSTEM_STATUS_TTL_SECONDS = 5.0
+_system_status_cache: Tuple[float, Optional[Dict]] = (0.0, None)
+
+
+@lru_cache(maxsize=BASELINE_CACHE_SIZE)
+def _cached_baseline_deviation(entity_type: str, entity_id: str, minute: int,
+                               failure_rate: float, auth_frequency: float,
+                               retry_rate: float, off_hours_rate: float) -> float:
+    """Baseline deviation for one entity's metrics, computed once per minute"""
+    return baseline_engine.get_baseline_deviation(entity_type, entity_id, {
+        "failure_rate": failure_rate,
+        "auth_frequency": auth_frequency,
+        "retry_rate": retry_rate,
+        "off_hours_rate": off_hours_rate,
+    })
+
+
+def _cached_system_status() -> Dict:
+    """baseline_engine.get_system_status(), refreshed at most every few seconds"""
+    global _system_status_cache
+    expires_at, status = _system_status_cache
+    now = time.monotonic()
+    if status is None or now >= expires_at:
+        status = baseline_engine.get_system_status()
+        _system_status_cache = (now + SYSTEM_STATUS_TTL_SECONDS, status)
+    return status
+
+
+# Private generator for score ids: the synthetic data generator reseeds the
+# global random module with a fixed seed, which would repeat ids across runs
+_score_id_random = random.Random()
+
+
+def _new_score_id() -> str:
+    """Random 48-bit score id; uniqueness matters here, unpredictability does not"""
+    return f"score_{_score_id_random.getrandbits(48):012x}"
+
+
 class RiskAnalysisEngine:
     """Main risk analysis engine combining rules and ML"""
     
@@ -369,33 +916,145 @@ class RiskAnalysisEngine:
         events_df = self._fetch_events(entity_type, entity_id, time_window_hours)
         
         if events_df.empty:
-            return {
-                "score_id": f"score_{uuid.uuid4().hex[:12]}",
-                "entity_type": entity_type,
-                "entity_id": entity_id,
-                "composite_score": 0.0,
-                "risk_level": "LOW",
-                "rule_score": 0.0,
-                "ml_score": 0.0,
-                "confidence_score": 0.0,
-                "action_tier": "MONITOR_ONLY",
-                "baseline_deviation": 0.0,
-                "contributing_factors": [],
-                "timestamp": datetime.now()
-            }
+            return self._empty_assessment(entity_type, entity_id)
         
-        # Run rule-based analysis
-        risk_factors = self.rule_analyzer.analyze(events_df)
-        rule_score = sum(f["contribution"] for f in risk_factors)
+        # Obviously benign or obviously malicious frames skip ML and baseline
+        triaged, risk_factors = self._fast_path(entity_type, entity_id, events_df)
+        if triaged is not None:
+            return triaged
+        
+        # Run rule-based analysis, unless triage already did
+        if risk_factors is None:
+            risk_factors = self.rule_analyzer.analyze(events_df)
         
         # Run ML anomaly detection
         ml_score, ml_confidence = self.ml_detector.predict_anomaly_score(events_df)
         
+        return self._build_assessment(entity_type, entity_id, events_df,
+                                      risk_factors, ml_score, ml_confidence)
+    
+    def analyze_entities(self, entity_type: str, entity_ids: List[str],
+                         time_window_hours: int = 24) -> Dict[str, Dict]:
+        """
+        Analyze risk for several entities of the same type
+        
+        Events for all entities come from one IN (...) query per chunk of ids,
+        rules run on a thread pool and the ML model scores all entities in a
+        single batched call. Returns assessments keyed by entity id, in the
+        order the ids were given.
+        """
+        # One clock reading stamps the whole batch
+        now = datetime.now()
+        frames = _fetch_entities_events(entity_type, entity_ids, time_window_hours,
+                                        int(now.timestamp() // 60))
+        assessments = {}
+        # Rule results triage already computed for frames it passed on
+        triaged_factors = {}
+        for entity_id, df in frames.items():
+            if not df.empty:
+                triaged, risk_factors = self._fast_path(entity_type, entity_id, df, now=now)
+                if triaged is not None:
+                    assessments[entity_id] = triaged
+                elif risk_factors is not None:
+                    triaged_factors[entity_id] = risk_factors
+        active_ids = [entity_id for entity_id, df in frames.items()
+                      if not df.empty and entity_id not in assessments]
+        active_dfs = [frames[entity_id] for entity_id in active_ids]
+        
+        pending_ids = [entity_id for entity_id in active_ids if entity_id not in triaged_factors]
+        triaged_factors.update(zip(pending_ids, Parallel(n_jobs=-1, prefer="threads")(
+            delayed(self.rule_analyzer.analyze)(frames[entity_id]) for entity_id in pending_ids
+        )))
+        rule_results = [triaged_factors[entity_id] for entity_id in active_ids]
+        ml_results = self.ml_detector.predict_anomaly_scores(active_dfs)
+        
+        for entity_id, df, risk_factors, (ml_score, ml_confidence) in zip(
+                active_ids, active_dfs, rule_results, ml_results):
+            assessments[entity_id] = self._build_assessment(
+                entity_type, entity_id, df, risk_factors, ml_score, ml_confidence, now=now
+            )
+        
+        return {
+            entity_id: assessments.get(entity_id) or self._empty_assessment(entity_type, entity_id, now=now)
+            for entity_id in frames
+        }
+    
+    def _fast_path(self, entity_type: str, entity_id: str, events_df,
+                   now: Optional[datetime] = None) -> Tuple[Optional[Dict], Optional[List[RiskFactor]]]:
+        """
+        Triage a frame before the expensive checks
+        
+        A handful of events with no failures skips the ML model and the
+        baselines, unless one of the rules fires on them; the z-score fallback
+        stands in for the model so the confidence is computed as on the full
+        path, and the baseline deviation is reported as 0.0. A large burst of
+        mostly failed authentications is CRITICAL without waiting on the ML
+        model. Returns (assessment, None) for a triaged frame, otherwise
+        (None, risk factors) with the rule results computed so far, if any.
+        """
+        n = len(events_df)
+        failure_count = int(_equals(events_df['status'], 'FAILURE').sum())
+        
+        if n < settings.FAST_PATH_BENIGN_MAX_EVENTS and failure_count == 0:
+            risk_factors = self.rule_analyzer.analyze(events_df)
+            if risk_factors:
+                return None, risk_factors
+            ml_score, ml_confidence = self.ml_detector._zscore_fallback(events_df)
+            return self._build_assessment(entity_type, entity_id, events_df,
+                                          risk_factors, ml_score, ml_confidence, now=now,
+                                          baseline_deviation=0.0), None
+        
+        if (n > settings.FAST_PATH_CRITICAL_MIN_EVENTS
+                and failure_count / n > settings.FAST_PATH_CRITICAL_FAILURE_RATE):
+            risk_factors = self.rule_analyzer.analyze(events_df)
+            assessment = self._empty_assessment(entity_type, entity_id, now=now)
+            assessment.update({
+                "composite_score": 100.0,
+                "risk_level": "CRITICAL",
+                "rule_score": round(sum(f.contribution for f in risk_factors), 2),
+                "confidence_score": round(failure_count / n, 3),
+                "action_tier": "IMMEDIATE_RESPONSE",
+                "contributing_factors": [f.to_dict() for f in risk_factors]
+            })
+            return assessment, None
+        
+        return None, None
+    
+    def _empty_assessment(self, entity_type: str, entity_id: str,
+                          now: Optional[datetime] = None) -> Dict:
+        """Assessment for an entity with no events in the window"""
+        return {
+            "score_id": _new_score_id(),
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "composite_score": 0.0,
+            "risk_level": "LOW",
+            "rule_score": 0.0,
+            "ml_score": 0.0,
+            "confidence_score": 0.0,
+            "action_tier": "MONITOR_ONLY",
+            "baseline_deviation": 0.0,
+            "contributing_factors": [],
+            "timestamp": now or datetime.now()
+        }
+    
+    def _build_assessment(self, entity_type: str, entity_id: str, events_df,
+                          risk_factors: List[RiskFactor], ml_score: float,
+                          ml_confidence: float, now: Optional[datetime] = None,
+                          baseline_deviation: Optional[float] = None) -> Dict:
+        """
+        Combine rule and ML results for one entity into a risk assessment
+        
+        The baseline deviation is looked up unless the caller passes one in.
+        """
+        rule_score = sum(f.contribution for f in risk_factors)
+        
         # Calculate confidence score (agreement between rules and ML)
         confidence_score = self._calculate_confidence_score(risk_factors, ml_score, ml_confidence)
         
         # Equity guardrail: Calculate baseline deviation
-        baseline_deviation = self._calculate_baseline_deviation(entity_type, entity_id, events_df)
+        if baseline_deviation is None:
+            baseline_deviation = self._calculate_baseline_deviation(entity_type, entity_id, events_df)
         
         # Apply equity normalization if needed
         normalized_rule_score = self._apply_equity_normalization(
@@ -412,24 +1071,24 @@ class RiskAnalysisEngine:
         
         # If ML has low confidence, add a note
         if ml_confidence < 0.5 and ml_score > 30:
-            risk_factors.append({
-                "rule_name": "ML_ANOMALY_DETECTED",
-                "contribution": ml_score * ML_WEIGHT,
-                "description": f"ML model detected potential anomaly (confidence: {ml_confidence:.0%})",
-                "severity": "MEDIUM" if ml_score < 60 else "HIGH"
-            })
+            risk_factors.append(RiskFactor(
+                "ML_ANOMALY_DETECTED",
+                ml_score * ML_WEIGHT,
+                f"ML model detected potential anomaly (confidence: {ml_confidence:.0%})",
+                Severity.MEDIUM if ml_score < 60 else Severity.HIGH
+            ))
         
         # Add baseline context if available
         if baseline_deviation > 0.3:
-            risk_factors.append({
-                "rule_name": "BASELINE_DEVIATION",
-                "contribution": baseline_deviation * 10,
-                "description": f"Significant deviation from regional baseline ({baseline_deviation:.0%})",
-                "severity": "MEDIUM"
-            })
+            risk_factors.append(RiskFactor(
+                "BASELINE_DEVIATION",
+                baseline_deviation * 10,
+                f"Significant deviation from regional baseline ({baseline_deviation:.0%})",
+                Severity.MEDIUM
+            ))
         
         return {
-            "score_id": f"score_{uuid.uuid4().hex[:12]}",
+            "score_id": _new_score_id(),
             "entity_type": entity_type,
             "entity_id": entity_id,
             "composite_score": round(composite_score, 2),
@@ -439,18 +1098,18 @@ class RiskAnalysisEngine:
             "confidence_score": round(confidence_score, 3),
             "action_tier": action_tier,
             "baseline_deviation": round(baseline_deviation, 3),
-            "contributing_factors": risk_factors,
-            "timestamp": datetime.now()
+            "contributing_factors": [f.to_dict() for f in risk_factors],
+            "timestamp": now or datetime.now()
         }
     
-    def _calculate_confidence_score(self, risk_factors: List[Dict], 
+    def _calculate_confidence_score(self, risk_factors: List[RiskFactor], 
                                    ml_score: float, ml_confidence: float) -> float:
         """
         Calculate confidence score based on agreement between rules and ML
         Returns: 0.0-1.0 confidence score
         """
         # Rule-based score
-        rule_score = sum(f["contribution"] for f in risk_factors)
+        rule_score = sum(f.contribution for f in risk_factors)
         
         # Normalize scores to 0-1
         normalized_rule = min(1.0, rule_score / 100.0)
@@ -474,7 +1133,7 @@ class RiskAnalysisEngine:
         # Severity consistency adds confidence
         severity_bonus = 0.0
         if risk_factors:
-            high_severity = sum(1 for f in risk_factors if f.get("severity") in ["HIGH", "CRITICAL"])
+            high_severity = sum(1 for f in risk_factors if f.severity >= Severity.HIGH)
             if high_severity > 0:
                 severity_bonus = min(0.15, high_severity * 0.05)
         
@@ -493,11 +1152,11 @@ class RiskAnalysisEngine:
                 "failure_rate": len(events_df[events_df['status'] == 'FAILURE']) / len(events_df),
                 "auth_frequency": len(events_df) / 24.0,  # events per hour
                 "retry_rate": events_df['retry_count'].mean(),
-                "off_hours_rate": len(events_df[(events_df['hour_of_day'] >= 23) | 
-                                               (events_df['hour_of_day'] <= 5)]) / len(events_df)
+                "off_hours_rate": _off_hours_mask(events_df['hour_of_day'].to_numpy()).mean()
             }
             
-            return baseline_engine.get_baseline_deviation(entity_type, entity_id, current_metrics)
+            return _cached_baseline_deviation(entity_type, entity_id, int(time.time() // 60),
+                                              **current_metrics)
             
         except Exception as e:
             print(f"Baseline deviation calculation error: {e}")
@@ -514,7 +1173,7 @@ class RiskAnalysisEngine:
         # don't penalize it as heavily
         
         # Get system status to check if baseline is ready
-        system_status = baseline_engine.get_system_status()
+        system_status = _cached_system_status()
         if not system_status.get("baseline_ready", False):
             return rule_score  # No normalization during baseline learning
         
@@ -534,7 +1193,7 @@ class RiskAnalysisEngine:
         return normalized_score
     
     def _determine_action_tier(self, composite_score: float, confidence_score: float, 
-                              risk_factors: List[Dict]) -> str:
+                              risk_factors: List[RiskFactor]) -> str:
         """
         Determine recommended action tier based on risk score, confidence, and factors
         """
@@ -544,8 +1203,8 @@ class RiskAnalysisEngine:
         
         if composite_score >= 70:
             # Check for specific high-risk patterns
-            velocity_attack = any(f.get("rule_name") == "HIGH_AUTH_FREQUENCY" for f in risk_factors)
-            geographic_anomaly = any(f.get("rule_name") == "GEOGRAPHIC_VELOCITY_ANOMALY" for f in risk_factors)
+            velocity_attack = any(f.rule_name == "HIGH_AUTH_FREQUENCY" for f in risk_factors)
+            geographic_anomaly = any(f.rule_name == "GEOGRAPHIC_VELOCITY_ANOMALY" for f in risk_factors)
             
             if velocity_attack and confidence_score >= 0.7:
                 return "DEVICE_BLACKLIST"
@@ -572,7 +1231,7 @@ class RiskAnalysisEngine:
             }
         
         risk_factors = self.rule_analyzer.analyze(events_df)
-        rule_score = sum(f["contribution"] for f in risk_factors)
+        rule_score = sum(f.contribution for f in risk_factors)
         
         ml_score, _ = self.ml_detector.predict_anomaly_score(events_df)
         
@@ -583,36 +1242,19 @@ class RiskAnalysisEngine:
             "risk_level": self._get_risk_level(composite_score),
             "rule_score": round(rule_score, 2),
             "ml_score": round(ml_score, 2),
-            "contributing_factors": risk_factors
+            "contributing_factors": [f.to_dict() for f in risk_factors]
         }
     
     def _fetch_events(self, entity_type: str, entity_id: str, 
                       time_window_hours: int) -> 'pd.DataFrame':
-        """Fetch events for analysis"""
-        start_time = datetime.now() - timedelta(hours=time_window_hours)
-        
-        if entity_type == "DEVICE":
-            query = """
-                SELECT * FROM authentication_events 
-                WHERE device_fingerprint_hash = ? AND timestamp >= ?
-                ORDER BY timestamp DESC
-            """
-        elif entity_type == "REGION":
-            query = """
-                SELECT * FROM authentication_events 
-                WHERE state_code = ? AND timestamp >= ?
-                ORDER BY timestamp DESC
-            """
-        elif entity_type == "SERVICE_PROVIDER":
-            query = """
-                SELECT * FROM authentication_events 
-                WHERE service_provider_id = ? AND timestamp >= ?
-                ORDER BY timestamp DESC
-            """
-        else:
-            return execute_query_df("SELECT * FROM authentication_events WHERE 1=0")
+        """
+        Fetch events for analysis
         
-        return execute_query_df(query, (entity_id, start_time))
+        The query result is reused for the rest of the current minute, or until
+        new events are written; the returned frame is the caller's own copy.
+        """
+        return _fetch_entity_events(entity_type, entity_id, time_window_hours,
+                                    int(time.time() // 60), events_version())
     
     def _get_risk_level(self, score: float) -> str:
         """Convert score to risk level"""
@@ -626,15 +1268,20 @@ class RiskAnalysisEngine:
     
     def train_ml_model(self):
         """Train the ML model on historical data"""
-        # Fetch last 30 days of data for training
-        query = """
-            SELECT * FROM authentication_events 
+        # Aggregate the last 30 days into per-device features in the database,
+        # limited to the 1000 earliest-seen devices
+        query = f"""
+            SELECT {ML_FEATURES_SQL}
+            FROM authentication_events 
             WHERE timestamp >= CURRENT_TIMESTAMP - INTERVAL 30 DAY
+            GROUP BY device_fingerprint_hash
+            ORDER BY MIN(timestamp)
+            LIMIT 1000
         """
         try:
-            df = execute_query_df(query)
-            if not df.empty:
-                self.ml_detector.train(df)
+            features_df = execute_query_df(query)
+            if not features_df.empty:
+                self.ml_detector.fit_features(features_df.to_numpy(dtype=float))
                 return True
         except Exception as e:
             print(f"Training failed: {e}")
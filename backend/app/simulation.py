@@ -2,13 +2,14 @@
 Simulation Module for AMEWS
 Generates synthetic misuse scenarios for testing purposes
 """
-import uuid
+import os
 import random
-from datetime import datetime, timedelta
-from typing import Dict, List
+from datetime import datetime
+from typing import Dict, Iterator, List, Set
 import asyncio
+import numpy as np
 
-from app.data_generator import SyntheticDataGenerator, STATES
+from app.data_generator import SyntheticDataGenerator, STATES, STATE_CODES
 from app.database import get_connection
 from app.risk_engine import risk_engine
 from app.alert_manager import alert_manager
@@ -18,6 +19,8 @@ class SimulationEngine:
     
     def __init__(self):
         self.generator = SyntheticDataGenerator(seed=None)  # Random seed for variety
+        # Scenario fields are drawn for all events of a scenario at once
+        self.rng = np.random.default_rng()
         self.active_simulations = {}
     
     async def run_simulation(self, scenario: str, intensity: float = 1.0,
@@ -25,39 +28,34 @@ class SimulationEngine:
                              target_region: str = None) -> Dict:
         """Run a misuse simulation scenario"""
         
-        simulation_id = f"sim_{uuid.uuid4().hex[:12]}"
+        simulation_id = f"sim_{os.urandom(6).hex()}"
         start_time = datetime.now()
         
-        self.active_simulations[simulation_id] = {
+        sim = {
             "status": "RUNNING",
             "scenario": scenario,
             "start_time": start_time
         }
+        self.active_simulations[simulation_id] = sim
         
         # Determine number of events based on intensity
         base_events = int(20 * intensity)
         
-        events = []
+        # Helpers stream their events and add the entity ids they touch as they go
+        events, touched = (), set()
         
-        if scenario == "DEVICE_SPIKE":
-            events = self._generate_device_spike(base_events, target_region)
-        elif scenario == "REGIONAL_ANOMALY":
-            events = self._generate_regional_anomaly(base_events, target_region)
-        elif scenario == "OTP_ABUSE":
-            events = self._generate_otp_abuse(base_events, target_region)
-        elif scenario == "OFF_HOURS_SPIKE":
-            events = self._generate_off_hours_spike(base_events, target_region)
-        elif scenario == "SERVICE_PROVIDER_ANOMALY":
-            events = self._generate_sp_anomaly(base_events, target_region)
+        generate = self._SCENARIOS.get(scenario)
+        if generate is not None:
+            events = generate(self, base_events, touched, target_region)
         
-        # Save events to database
-        saved = self.generator.save_to_database(events)
+        # Events are generated while being saved in chunks, off the event loop
+        saved = await asyncio.to_thread(self.generator.save_to_database, events)
         
         # Analyze and potentially generate alerts
-        await self._analyze_simulation_events(events, scenario)
+        await self._analyze_simulation_events(saved, scenario, touched)
         
-        self.active_simulations[simulation_id]["status"] = "COMPLETED"
-        self.active_simulations[simulation_id]["events_generated"] = saved
+        sim["status"] = "COMPLETED"
+        sim["events_generated"] = saved
         
         return {
             "simulation_id": simulation_id,
@@ -67,139 +65,155 @@ class SimulationEngine:
             "start_time": start_time
         }
     
-    def _generate_device_spike(self, count: int, region: str = None) -> List[Dict]:
+    def _spread_timestamps(self, base_time: datetime, count: int, max_offset: int,
+                           unit: str = "s") -> List[datetime]:
+        """count timestamps at random offsets of 0..max_offset units after base_time"""
+        offsets = self.rng.integers(0, max_offset + 1, size=count).astype(f"timedelta64[{unit}]")
+        return (np.datetime64(base_time) + offsets).tolist()
+    
+    def _generate_device_spike(self, count: int, touched: Set[str],
+                               region: str = None) -> Iterator[Dict]:
         """Generate device spike scenario - many auths from single device"""
-        events = []
-        
         # Use a single device for all events
         target_device = self.generator.device_pool[0]
-        target_region = region or random.choice(list(STATES.keys()))
+        target_region = region or random.choice(STATE_CODES)
         
         base_time = datetime.now()
-        
-        for i in range(count):
-            event = self.generator.generate_normal_event(
-                timestamp=base_time + timedelta(seconds=random.randint(0, 300))
+        timestamps = self._spread_timestamps(base_time, count, 300)
+        retries = self.rng.integers(2, 7, size=count).tolist()
+        
+        touched.add(target_device)
+        for timestamp, retry_count in zip(timestamps, retries):
+            yield self.generator.generate_normal_event(
+                timestamp=timestamp,
+                device_fingerprint_hash=target_device,
+                state_code=target_region,
+                retry_count=retry_count,
             )
-            event["device_fingerprint_hash"] = target_device
-            event["state_code"] = target_region
-            event["retry_count"] = random.randint(2, 6)
-            events.append(event)
-        
-        return events
     
-    def _generate_regional_anomaly(self, count: int, region: str = None) -> List[Dict]:
+    def _generate_regional_anomaly(self, count: int, touched: Set[str],
+                                   region: str = None) -> Iterator[Dict]:
         """Generate regional anomaly - unusual patterns in a region"""
-        events = []
-        
-        target_region = region or random.choice(list(STATES.keys()))
+        target_region = region or random.choice(STATE_CODES)
         districts = STATES[target_region]["districts"]
         
         base_time = datetime.now()
-        
-        for i in range(count):
-            event = self.generator.generate_normal_event(
-                timestamp=base_time + timedelta(seconds=random.randint(0, 600))
+        timestamps = self._spread_timestamps(base_time, count, 600)
+        district_codes = self.rng.choice(districts, size=count).tolist()
+        retries = self.rng.integers(2, 6, size=count).tolist()
+        hours = self.rng.choice([2, 3, 4, 23], size=count).tolist()  # Off hours
+        fallbacks = (self.rng.random(count) < 0.4).tolist()  # High fallback rate
+        
+        touched.add(target_region)
+        for timestamp, district_code, retry_count, hour, is_fallback in zip(
+                timestamps, district_codes, retries, hours, fallbacks):
+            yield self.generator.generate_normal_event(
+                timestamp=timestamp,
+                state_code=target_region,
+                district_code=district_code,
+                retry_count=retry_count,
+                hour_of_day=hour,
+                is_fallback=is_fallback,
             )
-            event["state_code"] = target_region
-            event["district_code"] = random.choice(districts)
-            event["retry_count"] = random.randint(2, 5)
-            event["hour_of_day"] = random.choice([2, 3, 4, 23])  # Off hours
-            event["is_fallback"] = random.random() < 0.4  # High fallback rate
-            events.append(event)
-        
-        return events
     
-    def _generate_otp_abuse(self, count: int, region: str = None) -> List[Dict]:
+    def _generate_otp_abuse(self, count: int, touched: Set[str],
+                            region: str = None) -> Iterator[Dict]:
         """Generate OTP abuse scenario - excessive OTP fallbacks"""
-        events = []
-        
         # Use a small pool of devices
         target_devices = self.generator.device_pool[:5]
         base_time = datetime.now()
-        
-        for i in range(count):
+        timestamps = self._spread_timestamps(base_time, count, 600)
+        devices = self.rng.choice(target_devices, size=count).tolist()
+        retries = self.rng.integers(2, 9, size=count).tolist()
+        statuses = self.rng.choice(["SUCCESS", "FAILURE", "FAILURE"], size=count).tolist()
+        reasons = self.rng.choice(["OTP_EXPIRED", "OTP_INVALID"], size=count).tolist()
+        
+        for timestamp, device, retry_count, status, reason in zip(
+                timestamps, devices, retries, statuses, reasons):
             event = self.generator.generate_normal_event(
-                timestamp=base_time + timedelta(seconds=random.randint(0, 600))
+                timestamp=timestamp,
+                device_fingerprint_hash=device,
+                auth_type="OTP",
+                is_fallback=True,
+                retry_count=retry_count,
+                status=status,
             )
-            event["device_fingerprint_hash"] = random.choice(target_devices)
-            event["auth_type"] = "OTP"
-            event["is_fallback"] = True
-            event["retry_count"] = random.randint(2, 8)
-            event["status"] = random.choice(["SUCCESS", "FAILURE", "FAILURE"])
-            if event["status"] == "FAILURE":
-                event["failure_reason"] = random.choice(["OTP_EXPIRED", "OTP_INVALID"])
-            events.append(event)
-        
-        return events
+            if status == "FAILURE":
+                event["failure_reason"] = reason
+            touched.add(device)
+            yield event
     
-    def _generate_off_hours_spike(self, count: int, region: str = None) -> List[Dict]:
+    def _generate_off_hours_spike(self, count: int, touched: Set[str],
+                                  region: str = None) -> Iterator[Dict]:
         """Generate off-hours spike - authentications during unusual hours"""
-        events = []
-        
-        target_region = region or random.choice(list(STATES.keys()))
+        target_region = region or random.choice(STATE_CODES)
         
         # Set time to off-hours
         base_time = datetime.now().replace(hour=random.choice([2, 3, 4]))
-        
-        for i in range(count):
-            event = self.generator.generate_normal_event(
-                timestamp=base_time + timedelta(minutes=random.randint(0, 120))
+        timestamps = self._spread_timestamps(base_time, count, 120, "m")
+        hours = self.rng.integers(1, 6, size=count).tolist()
+        
+        touched.add(target_region)
+        for timestamp, hour in zip(timestamps, hours):
+            yield self.generator.generate_normal_event(
+                timestamp=timestamp,
+                state_code=target_region,
+                hour_of_day=hour,
             )
-            event["state_code"] = target_region
-            event["hour_of_day"] = random.choice([1, 2, 3, 4, 5])
-            events.append(event)
-        
-        return events
     
-    def _generate_sp_anomaly(self, count: int, region: str = None) -> List[Dict]:
+    def _generate_sp_anomaly(self, count: int, touched: Set[str],
+                             region: str = None) -> Iterator[Dict]:
         """Generate service provider anomaly"""
-        events = []
-        
         # Use single service provider
         target_sp = "SP_ANOMALY_TEST_abc123"
         base_time = datetime.now()
-        
-        for i in range(count):
-            event = self.generator.generate_normal_event(
-                timestamp=base_time + timedelta(seconds=random.randint(0, 600))
+        timestamps = self._spread_timestamps(base_time, count, 600)
+        retries = self.rng.integers(3, 11, size=count).tolist()
+        durations = self.rng.integers(10000, 50001, size=count).tolist()  # Very long sessions
+        
+        touched.add(target_sp)
+        for timestamp, retry_count, duration in zip(timestamps, retries, durations):
+            yield self.generator.generate_normal_event(
+                timestamp=timestamp,
+                service_provider_id=target_sp,
+                retry_count=retry_count,
+                session_duration_ms=duration,
             )
-            event["service_provider_id"] = target_sp
-            event["retry_count"] = random.randint(3, 10)
-            event["session_duration_ms"] = random.randint(10000, 50000)  # Very long sessions
-            events.append(event)
-        
-        return events
     
-    async def _analyze_simulation_events(self, events: List[Dict], scenario: str):
-        """Analyze simulated events and generate alerts if warranted"""
-        if not events:
+    # Generator for each scenario, and the entity type its events are analyzed by
+    _SCENARIOS = {
+        "DEVICE_SPIKE": _generate_device_spike,
+        "REGIONAL_ANOMALY": _generate_regional_anomaly,
+        "OTP_ABUSE": _generate_otp_abuse,
+        "OFF_HOURS_SPIKE": _generate_off_hours_spike,
+        "SERVICE_PROVIDER_ANOMALY": _generate_sp_anomaly,
+    }
+    _SCENARIO_ENTITY_TYPES = {
+        "DEVICE_SPIKE": "DEVICE",
+        "OTP_ABUSE": "DEVICE",
+        "REGIONAL_ANOMALY": "REGION",
+        "OFF_HOURS_SPIKE": "REGION",
+        "SERVICE_PROVIDER_ANOMALY": "SERVICE_PROVIDER",
+    }
+    
+    async def _analyze_simulation_events(self, saved: int, scenario: str,
+                                         entities: Set[str]):
+        """Analyze the entities a simulation touched and generate alerts if warranted"""
+        if not saved or not entities:
             return
         
-        # Group by entity type based on scenario
-        if scenario in ["DEVICE_SPIKE", "OTP_ABUSE"]:
-            # Analyze by device
-            devices = set(e["device_fingerprint_hash"] for e in events)
-            for device in devices:
-                assessment = risk_engine.analyze_entity("DEVICE", device, time_window_hours=1)
-                if assessment["composite_score"] >= 50:
-                    alert_manager.generate_alert(assessment, "DEVICE", device)
-        
-        elif scenario in ["REGIONAL_ANOMALY", "OFF_HOURS_SPIKE"]:
-            # Analyze by region
-            regions = set(e["state_code"] for e in events)
-            for region in regions:
-                assessment = risk_engine.analyze_entity("REGION", region, time_window_hours=1)
-                if assessment["composite_score"] >= 50:
-                    alert_manager.generate_alert(assessment, "REGION", region)
-        
-        elif scenario == "SERVICE_PROVIDER_ANOMALY":
-            # Analyze by service provider
-            sps = set(e["service_provider_id"] for e in events)
-            for sp in sps:
-                assessment = risk_engine.analyze_entity("SERVICE_PROVIDER", sp, time_window_hours=1)
-                if assessment["composite_score"] >= 50:
-                    alert_manager.generate_alert(assessment, "SERVICE_PROVIDER", sp)
+        entity_type = self._SCENARIO_ENTITY_TYPES.get(scenario)
+        if entity_type is None:
+            return
+        
+        # One batched analysis for all touched entities, off the event loop
+        assessments = await asyncio.to_thread(
+            risk_engine.analyze_entities, entity_type, list(entities), 1
+        )
+        
+        for entity_id, assessment in assessments.items():
+            if assessment["composite_score"] >= 50:
+                alert_manager.generate_alert(assessment, entity_type, entity_id)
     
     def get_active_simulations(self) -> Dict:
         """Get list of active simulations"""
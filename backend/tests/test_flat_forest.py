@@ -0,0 +1,52 @@
+"""
+Regression test for the float32 ML scoring path
+
+FlatIsolationForest with the scaler cached by MLAnomalyDetector._cache_scaler
+must keep scoring like sklearn's IsolationForest on float64 features.
+"""
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from app.risk_engine import FlatIsolationForest, MLAnomalyDetector
+
+# Largest allowed difference between the two decision function values
+SCORE_TOLERANCE = 0.01
+
+
+def _random_features(rng, rows: int) -> np.ndarray:
+    """Feature rows on scales like the 12 entity features, with some outliers"""
+    scales = np.array([1, 0.1, 3, 0.1, 0.2, 5, 2, 1, 0.5, 2000, 0.2, 100])
+    offsets = np.array([0.5, 0.1, 12, 0.05, 0.3, 10, 5, 3, 1, 2500, 0.2, 300])
+    X = rng.normal(size=(rows, 12)) * scales + offsets
+    outliers = rng.random(rows) < 0.05
+    X[outliers] *= rng.uniform(2, 6, size=(outliers.sum(), 1))
+    return X
+
+
+def test_flat_forest_matches_sklearn_score_samples():
+    rng = np.random.default_rng(7)
+    X_train = _random_features(rng, 2000)
+    X = _random_features(rng, 500)
+    
+    scaler = StandardScaler().fit(X_train)
+    model = IsolationForest(n_estimators=100, contamination=0.05, random_state=42)
+    model.fit(scaler.transform(X_train))
+    
+    # Reference: float64 features through sklearn
+    expected = model.score_samples(scaler.transform(X)) - model.offset_
+    
+    # Fast path: float32 features scaled with the cached mean and reciprocal scale
+    detector = MLAnomalyDetector()
+    detector.model = model
+    detector.scaler = scaler
+    detector._compile_forest()
+    detector._cache_scaler()
+    assert isinstance(detector._flat_forest, FlatIsolationForest)
+    
+    features = X.astype(np.float32)
+    np.subtract(features, detector._scaler_mean, out=features)
+    np.multiply(features, detector._scaler_inv_scale, out=features)
+    actual = detector._flat_forest.decision_function(features)
+    
+    assert np.max(np.abs(actual - expected)) <= SCORE_TOLERANCE